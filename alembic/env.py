@@ -1,6 +1,7 @@
 from logging.config import fileConfig
 
 from server.models import User, Course, Post
+from server.settings import DatabaseSettings
 from sqlmodel import SQLModel
 
 from sqlalchemy import engine_from_config
@@ -24,6 +25,18 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = SQLModel.metadata
 
+# Migrate the same database the server is configured to use
+config.set_main_option("sqlalchemy.url", DatabaseSettings.from_env().url)
+
+
+def include_name(name, type_, parent_names):
+    """Leave the FTS5 search table, and the shadow tables SQLite creates for it,
+    to the migrations that manage them by hand"""
+    if type_ == "table":
+        return not name.startswith("post_fts")
+    return True
+
+
 # print out all tables
 print("All tables in the database:")
 for table in target_metadata.tables:
@@ -51,6 +64,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         compare_type=True,
         include_schemas=True,
@@ -79,6 +93,7 @@ def run_migrations_online() -> None:
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
+            include_name=include_name,
             include_schemas=True,
             compare_type=True,
             render_as_batch=True
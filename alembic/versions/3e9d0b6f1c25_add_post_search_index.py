@@ -0,0 +1,36 @@
+"""Add full-text search index over posts
+
+Revision ID: 3e9d0b6f1c25
+Revises: 8c4f2a91e6d7
+Create Date: 2024-04-22 09:41:15.230874
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e9d0b6f1c25'
+down_revision: Union[str, None] = '8c4f2a91e6d7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+        "title, description, content, course_id UNINDEXED, tokenize='porter unicode61')"
+    )
+    # Index the posts of every existing course
+    op.execute(
+        "INSERT INTO post_fts (rowid, title, description, content, course_id) "
+        "SELECT post.id, post.title, post.description, post.content, post.course_id "
+        "FROM post JOIN course ON course.id = post.course_id"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS post_fts")
@@ -0,0 +1,50 @@
+"""Add lookup indexes and unique course titles
+
+Revision ID: 5b1e7c2d9a43
+Revises: 0fa98e9cfd8f
+Create Date: 2024-04-15 10:12:44.518392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e7c2d9a43'
+down_revision: Union[str, None] = '0fa98e9cfd8f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Course titles must be unique before the unique index can be created. Keep the
+    # oldest course under each title, and suffix the id onto the titles of the others.
+    op.execute(
+        "UPDATE course SET title = title || ' (' || id || ')' "
+        "WHERE id NOT IN (SELECT MIN(id) FROM course GROUP BY title)"
+    )
+
+    with op.batch_alter_table('course', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_course_title'), ['title'], unique=True)
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_post_author_id'), ['author_id'], unique=False)
+        batch_op.create_index('ix_post_course_id_created_at', ['course_id', 'created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('approval', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_approval_user_id'), ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('approval', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_approval_user_id'))
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_course_id_created_at')
+        batch_op.drop_index(batch_op.f('ix_post_author_id'))
+
+    with op.batch_alter_table('course', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_course_title'))
@@ -0,0 +1,40 @@
+"""Denormalize approval count and approvers onto post
+
+Revision ID: 8c4f2a91e6d7
+Revises: 5b1e7c2d9a43
+Create Date: 2024-04-18 14:03:27.906215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4f2a91e6d7'
+down_revision: Union[str, None] = '5b1e7c2d9a43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('approval_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('approver_usernames', sa.JSON(), server_default='[]', nullable=False))
+
+    # Backfill the summary from the existing approvals
+    op.execute(
+        "UPDATE post SET "
+        "approval_count = (SELECT count(approval.id) FROM approval WHERE approval.post_id = post.id), "
+        "approver_usernames = (SELECT json_group_array(username) FROM ("
+        "SELECT user.username AS username FROM user JOIN approval ON approval.user_id = user.id "
+        "WHERE approval.post_id = post.id ORDER BY approval.id))"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_column('approver_usernames')
+        batch_op.drop_column('approval_count')
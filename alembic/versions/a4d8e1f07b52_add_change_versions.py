@@ -0,0 +1,32 @@
+"""Add change versions, from which ETags are derived
+
+Revision ID: a4d8e1f07b52
+Revises: 3e9d0b6f1c25
+Create Date: 2024-04-22 10:12:48.331907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d8e1f07b52'
+down_revision: Union[str, None] = '3e9d0b6f1c25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'changeversion',
+        sa.Column('scope', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('scope')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('changeversion')
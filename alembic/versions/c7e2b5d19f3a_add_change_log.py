@@ -0,0 +1,39 @@
+"""Add the change log, for clients catching up on changes
+
+Revision ID: c7e2b5d19f3a
+Revises: a4d8e1f07b52
+Create Date: 2024-04-29 15:41:07.512846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e2b5d19f3a'
+down_revision: Union[str, None] = 'a4d8e1f07b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'change',
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('type', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('course_id', sa.Integer(), nullable=False),
+        sa.Column('course_title', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+        sqlite_autoincrement=True
+    )
+    op.create_index(op.f('ix_change_created_at'), 'change', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_change_created_at'), table_name='change')
+    op.drop_table('change')
@@ -0,0 +1,50 @@
+"""Make the post search index contentless, so it holds no copy of post content
+
+Revision ID: f3b8a6c2d071
+Revises: c7e2b5d19f3a
+Create Date: 2024-05-02 10:12:44.381907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+from server.compression import decode_content
+from server.search import CREATE_POST_FTS, rebuild_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8a6c2d071'
+down_revision: Union[str, None] = 'c7e2b5d19f3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS post_fts")
+    op.execute(CREATE_POST_FTS)
+    # Index the posts of every existing course, decompressing content as it's read
+    rebuild_index(sqlmodel.Session(bind=op.get_bind()))
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS post_fts")
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+        "title, description, content, course_id UNINDEXED, tokenize='porter unicode61')"
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.text(
+        "SELECT post.id, post.title, post.description, post.content, post.course_id "
+        "FROM post JOIN course ON course.id = post.course_id"
+    )).all()
+    if rows:
+        connection.execute(
+            sa.text(
+                "INSERT INTO post_fts (rowid, title, description, content, course_id) "
+                "VALUES (:id, :title, :description, :content, :course_id)"
+            ),
+            [{**row._asdict(), 'content': decode_content(row.content)} for row in rows]
+        )
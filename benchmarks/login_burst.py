@@ -0,0 +1,115 @@
+"""
+benchmarks/login_burst.py
+
+Measure how bursts of logins affect the latency of other requests.
+
+Concurrent readers fetch the course list while bursts of logins arrive, each login
+verifying its password with PBKDF2. With `inline` hashing, the hash runs in the request
+handler as it would without the thread pool, and every other request waits for it. With
+`pool` hashing, the hash runs in the password thread pool. Run with:
+
+    python -m benchmarks.login_burst [--duration 10] [--readers 8] [--burst 20]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+
+async def reader(client, latencies: list[float], deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/courses")
+        assert response.status_code == 200
+        latencies.append(time.perf_counter() - started)
+
+
+async def login_bursts(client, burst: int, interval: float, deadline: float) -> int:
+    logins = 0
+    while time.perf_counter() < deadline:
+        responses = await asyncio.gather(*(
+            client.post("/login", json={"username": "admin", "password": "password"}) for _ in range(burst)
+        ))
+        assert all(response.json()["logged_in"] for response in responses)
+        logins += burst
+        await asyncio.sleep(interval)
+    return logins
+
+
+async def run_mode(mode: str, args) -> str:
+    import httpx
+
+    import main
+    from server import passwords
+    from server.models import UserRole
+    from server.session_security import UserSessionManager
+
+    run = passwords._run
+    if mode == "inline":
+        async def run_inline(function, *function_args):
+            return function(*function_args)
+        passwords._run = run_inline
+
+    token = UserSessionManager.sign_jwt(1, UserRole.admin)
+    transport = httpx.ASGITransport(app=main.app)
+    latencies: list[float] = []
+    deadline = time.perf_counter() + args.duration
+    try:
+        # The login route logs each login to stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with httpx.AsyncClient(transport=transport, base_url="http://localhost",
+                                         cookies={"access_token": f"Bearer {token}"}) as readers, \
+                    httpx.AsyncClient(transport=transport, base_url="http://localhost") as logins:
+                *_, login_count = await asyncio.gather(
+                    *(reader(readers, latencies, deadline) for _ in range(args.readers)),
+                    login_bursts(logins, args.burst, args.interval, deadline),
+                )
+    finally:
+        passwords._run = run
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    return (f"{len(latencies) / args.duration:>8.0f} {p50:>9.2f} {p99:>9.2f} {latencies[-1] * 1000:>9.2f} "
+            f"{login_count / args.duration:>9.1f}")
+
+
+async def run_modes(args) -> None:
+    # Both modes run in one event loop, which the server's connection pool is bound to
+    for mode in ("inline", "pool"):
+        print(f"{mode:<8} {await run_mode(mode, args)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run each mode for")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--burst", type=int, default=20, help="logins arriving at once")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between bursts")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The server creates its database, with the sample users, when it's first imported
+        os.environ["DATABASE_URL"] = f"sqlite:///{Path(directory) / 'benchmark.sqlite3'}"
+        from sqlmodel import SQLModel
+        import server.search  # noqa: F401, registers every table
+        from server.engine import make_engine
+        from server.settings import DatabaseSettings
+        engine = make_engine(DatabaseSettings.from_env())
+        SQLModel.metadata.create_all(engine)
+        engine.dispose()
+
+        print(f"{args.readers} readers, bursts of {args.burst} logins every {args.interval}s, "
+              f"{args.duration:.0f}s each\n")
+        print(f"{'hashing':<8} {'reads/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} {'logins/s':>9}")
+        asyncio.run(run_modes(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+benchmarks/sqlite_profiles.py
+
+Compare the `default` and `tuned` SQLite profiles under a mixed read/write workload.
+
+Each profile gets a fresh database seeded with one course of posts. Concurrent readers then
+fetch pages of the course's post list, while concurrent writers create posts, each in its
+own transaction, all through the async engine used by the API. Run with:
+
+    python -m benchmarks.sqlite_profiles [--duration 10] [--readers 16] [--writers 4]
+"""
+
+import argparse
+import asyncio
+import datetime
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from server.engine import make_async_engine, make_engine
+from server.models import Course, Post, User, UserRole
+from server.queries import get_course_post_page
+from server.settings import DatabaseSettings, SQLiteProfile
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.errors = 0
+
+    def summary(self, duration: float) -> str:
+        if not self.latencies:
+            return f"{'0':>8} {'-':>9} {'-':>9} {self.errors:>7}"
+        latencies = sorted(self.latencies)
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        return f"{len(latencies) / duration:>8.0f} {p50:>9.2f} {p99:>9.2f} {self.errors:>7}"
+
+
+def seed(settings: DatabaseSettings, posts: int) -> None:
+    engine = make_engine(settings)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(id=1, username="author", password="password", role=UserRole.user))
+        session.add(Course(id=1, title="Benchmark", description="Benchmark course", author_id=1))
+        start = datetime.datetime(2024, 1, 1)
+        session.add_all([
+            Post(title=f"Post {i}", description="Seeded post", type="note", content="x" * 500,
+                 author_id=1, course_id=1, created_at=start + datetime.timedelta(seconds=i))
+            for i in range(posts)
+        ])
+        session.commit()
+    engine.dispose()
+
+
+async def reader(engine, stats: Stats, deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            async with AsyncSession(engine) as session:
+                await session.run_sync(get_course_post_page, 1, 50)
+            stats.latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            stats.errors += 1
+
+
+async def writer(engine, stats: Stats, deadline: float) -> None:
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            async with AsyncSession(engine) as session:
+                session.add(Post(title="New post", description="Benchmark write", type="note",
+                                 content="y" * 500, author_id=1, course_id=1))
+                await session.commit()
+            stats.latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            stats.errors += 1
+
+
+async def run_profile(profile: SQLiteProfile, args, directory: Path) -> tuple[Stats, Stats]:
+    settings = DatabaseSettings(
+        url=f"sqlite:///{directory / f'{profile.value}.sqlite3'}",
+        sqlite_profile=profile,
+        pool_size=args.readers + args.writers
+    )
+    seed(settings, args.posts)
+    engine = make_async_engine(settings)
+
+    reads, writes = Stats(), Stats()
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(
+        *(reader(engine, reads, deadline) for _ in range(args.readers)),
+        *(writer(engine, writes, deadline) for _ in range(args.writers)),
+    )
+    await engine.dispose()
+    return reads, writes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run each profile for")
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--posts", type=int, default=10000, help="posts to seed the course with")
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.posts} seeded posts, {args.duration:.0f}s each\n")
+    print(f"{'profile':<8} {'op':<6} {'ops/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in SQLiteProfile:
+            reads, writes = asyncio.run(run_profile(profile, args, Path(directory)))
+            print(f"{profile.value:<8} {'read':<6} {reads.summary(args.duration)}")
+            print(f"{profile.value:<8} {'write':<6} {writes.summary(args.duration)}")
+
+
+if __name__ == "__main__":
+    main()
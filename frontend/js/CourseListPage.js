@@ -57,7 +57,7 @@ class CourseListPage {
         return $.ajax({
             url: `${this.serverUrl}/courses/`,
             type: 'GET',
-            cache: false,
+            // Revalidated with the server's ETag, so an unchanged list isn't downloaded again
             async: false,
             contentType: 'application/json; charset=utf-8',
             xhrFields: { withCredentials: true },
@@ -14,22 +14,98 @@ class CoursePostListPage {
         this.courseId;
         this.courseDescription;
         this.posts = [];
+        this.events = null;
     }
 
-    loadPosts() {
-        return $.ajax({
-            url: `${this.serverUrl}/courses/${this.courseTitle}/posts/`,
+    // Load the course, the user's status and the first page of posts in one request, then
+    // the rest of the posts. Returns the first request, whose response includes the user.
+    loadPage() {
+        this.posts = [];
+        const request = $.ajax({
+            url: `${this.serverUrl}/courses/${this.courseTitle}/page`,
             type: 'GET',
             async: false,
-            cache: false,
-            contentType: 'application/json; charset=utf-8',
+            data: { summary: true },
             xhrFields: { withCredentials: true },
             success: (response) => {
-                this.posts = response.map(post => ({
-                    ...post
-                }));
+                this.courseId = response.course.id;
+                this.courseDescription = response.course.description;
+                this.posts.push(...response.posts);
             }
         });
+        const cursor = request.status === 200 ? request.getResponseHeader('X-Next-Cursor') : null;
+        if (cursor) {
+            this.loadPosts(cursor);
+        }
+        return request;
+    }
+
+    loadPosts(cursor = null) {
+        // Posts are served one page at a time; follow the cursor until the last page
+        if (!cursor) {
+            this.posts = [];
+        }
+        let request;
+        do {
+            request = $.ajax({
+                url: `${this.serverUrl}/courses/${this.courseTitle}/posts/`,
+                type: 'GET',
+                async: false,
+                // The list only needs each post's summary; the content is loaded when a row is expanded
+                data: cursor ? { summary: true, after: cursor } : { summary: true },
+                contentType: 'application/json; charset=utf-8',
+                xhrFields: { withCredentials: true },
+                success: (response) => {
+                    this.posts.push(...response.map(post => ({
+                        ...post
+                    })));
+                }
+            });
+            cursor = request.status === 200 ? request.getResponseHeader('X-Next-Cursor') : null;
+        } while (cursor);
+        return request;
+    }
+
+    // Follow the course's live updates, patching this.posts in place. onChange is called
+    // after each change, and onDeleted once the course has been deleted.
+    subscribe(onChange, onDeleted) {
+        this.unsubscribe();
+        this.events = new EventSource(
+            `${this.serverUrl}/courses/${this.courseTitle}/events`, { withCredentials: true });
+
+        this.events.addEventListener('post-created', (event) => {
+            const post = JSON.parse(event.data);
+            if (!this.posts.some(p => p.id === post.id)) {
+                this.posts.push(post);
+                onChange();
+            }
+        });
+        const updateApprovers = (event) => {
+            const update = JSON.parse(event.data);
+            const post = this.posts.find(p => p.id === update.id);
+            if (post) {
+                post.approvers = update.approvers;
+                onChange();
+            }
+        };
+        this.events.addEventListener('post-approved', updateApprovers);
+        this.events.addEventListener('post-unapproved', updateApprovers);
+        // Events were missed, so the only way to catch up is to reload the list
+        this.events.addEventListener('resync', () => {
+            this.loadPosts();
+            onChange();
+        });
+        this.events.addEventListener('course-deleted', () => {
+            this.unsubscribe();
+            onDeleted();
+        });
+    }
+
+    unsubscribe() {
+        if (this.events) {
+            this.events.close();
+            this.events = null;
+        }
     }
 
     createPost(postData) {
@@ -71,9 +147,24 @@ class CoursePostListPage {
         });
     }
 
+    loadPostContent(post) {
+        $.ajax({
+            url: `${this.serverUrl}/courses/${this.courseTitle}/posts/${post.id}`,
+            type: 'GET',
+            async: false,
+            xhrFields: { withCredentials: true },
+            success: (response) => {
+                post.content = response.content;
+            }
+        });
+    }
+
     formatPostContent(index, row) {
         const post = this.posts.find(p => p.id === row.id);
 
+        if (post.content === undefined) {
+            this.loadPostContent(post);
+        }
         return post.content;
     }
 
@@ -4,15 +4,22 @@ main.py
 Defines the FastAPI backend server configuration and all API endpoints.
 """
 
-from typing import Generator, Union, Annotated, Optional, Callable
+import json
+import time
+from urllib.parse import quote
+from typing import AsyncGenerator, Union, Annotated, Optional, Callable
 
+import orjson
 from pydantic import BaseModel
 from jose import JWTError
-from sqlmodel import Session, select, delete
+from sqlmodel import select, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi import (
     FastAPI,
     HTTPException,
     Depends,
+    Query,
+    Request,
     Response,
     Security
 )
@@ -21,12 +28,40 @@ from starlette.status import (
     HTTP_403_FORBIDDEN
 )
 from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
-from server.session_security import OAuth2PasswordBearerWithCookie, UserSessionManager
-from server.models import User, Course, UserRole, Post, PostWithAuthor, Approval
-from sqlalchemy.orm import joinedload
+from server.session_security import OAuth2PasswordBearerWithCookie, TokenData, UserSessionManager, token_cache
+from server.models import (
+    User, Course, UserRole, Post, PostWithAuthor, PostSummary, SearchResult, BulkPostsResponse,
+    ApprovalChanges, ApprovalChangesResult, ChangeFeed
+)
+from server.approvals import approve_posts, get_approval_summaries, unapprove_posts
+from server.bulk import insert_posts, parse_ndjson, validate_posts, MAX_BULK_POSTS
+from server.cache import CourseRecord, course_cache
+from server.changes import ChangeType, get_changes, record_course_change, record_post_changes, record_resync
+from server.events import EventType, course_events
+from server.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, pool_stats, render_request_metrics, render_stats,
+    request_metrics
+)
+from server.export import ExportFormat, stream_course_posts
+from server.queries import (
+    InvalidFields, get_course_page, get_course_post_page, get_course_rows, get_post_summary, narrow_rows, parse_fields
+)
+from server.search import index_post, unindex_course, search_posts
+from server import passwords
+from server.passwords import hash_password, verify_password
+from server.pagination import (
+    Cursor, InvalidCursor, SortOrder, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, page_cursor_headers
+)
+from server.singleflight import course_post_flights
+from server.versions import (
+    bump_all_versions, bump_post_versions, bump_versions, etag_matches, get_versions, make_etag
+)
 
 
 app = FastAPI()
@@ -45,7 +80,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "ETag"],
 )
+# Added last, so it's the outermost middleware and times the whole of each request
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
 
 
 class UserLoginSchema(BaseModel):
@@ -66,35 +104,53 @@ class UserStatusSchema(BaseModel):
     role: Optional[int] = None
 
 
+class CoursePageSchema(BaseModel):
+    course: Course
+    user: UserStatusSchema
+    posts: Union[list[PostSummary], list[PostWithAuthor]]
+
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl")
+
 # OAuth2
 oauth2_scheme = OAuth2PasswordBearerWithCookie(tokenUrl="login")
 optional_oauth2_scheme = OAuth2PasswordBearerWithCookie(
     tokenUrl="login", auto_error=False)
 
 
-def get_session() -> Generator[Session, None, None]:
-    from server.db import engine
-    with Session(engine) as session:
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    from server.db import async_engine
+    # Attributes can't be lazily reloaded outside of an awaited call, so don't expire them
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_async_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """Session for requests which only read. It may be connected to a replica, so
+    it can lag slightly behind writes made through `get_async_session`."""
+    from server.db import async_read_engine
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
         yield session
 
 
-async def get_user_data(user_id: int, session: Session = Depends(get_session)) -> UserStatusSchema:
+async def get_user_data(user_id: int, session: AsyncSession = Depends(get_async_read_session)) -> UserStatusSchema:
     """Get user data from the database
     """
-    user = session.exec(select(User).where(User.id == user_id)).first()
+    user = (await session.exec(select(User).where(User.id == user_id))).first()
     if user:
         return UserStatusSchema(logged_in=True, username=user.username, email=user.email, role=user.role)
     else:
         raise HTTPException(status_code=404, detail="User not found")
 
 
-def ensure_user_role(
+def ensure_user_token(
         require_roles: list[UserRole]
         ) -> Callable:
+    """Dependency which verifies the request's token, and returns its claims"""
 
-    async def verify_user_role(
+    async def verify_user_token(
         access_token: str = Security(oauth2_scheme)
-    ) -> int:
+    ) -> TokenData:
         credentials_exception = HTTPException(
             status_code=HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -103,31 +159,118 @@ def ensure_user_role(
         try:
             token_data = UserSessionManager.decode_jwt(access_token)
             if token_data:
-                user_id = token_data.user_id
                 user_role = token_data.role
                 if user_role not in require_roles:
                     raise HTTPException(
                         status_code=HTTP_403_FORBIDDEN,
                         detail="Not enough permissions",
                     )
-                return user_id
+                return token_data
             else:
                 raise credentials_exception
         except (JWTError, ValidationError):
             raise credentials_exception
 
+    return verify_user_token
+
+
+def ensure_user_role(
+        require_roles: list[UserRole]
+        ) -> Callable:
+    """Dependency which verifies the request's token, and returns the id of its user"""
+    verify_user_token = ensure_user_token(require_roles)
+
+    async def verify_user_role(token_data: TokenData = Depends(verify_user_token)) -> int:
+        return token_data.user_id
+
     return verify_user_role
 
 
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Set the ETag of a response. If the client already has this version, return a 304
+    response to send instead, so the caller can skip building the response."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+async def render_course_post_page(
+        engine: AsyncEngine,
+        course_id: int,
+        limit: int,
+        after: Optional[Cursor],
+        before: Optional[Cursor],
+        order: SortOrder,
+        summary: bool,
+        fields: Optional[tuple[str, ...]] = None
+        ) -> tuple[bytes, dict[str, str]]:
+    """Query a page of a course's posts, and serialize it along with its cursor headers.
+
+    The query runs on a session of its own, since the result may be shared by requests
+    other than the one which started it. The rows are built by the query from database
+    columns, so they are serialized as they are, without being validated against the
+    response model first.
+    """
+    async with AsyncSession(engine) as session:
+        posts, has_more = await session.run_sync(
+            get_course_post_page, course_id, limit, after, before, order, summary, fields)
+    headers = page_cursor_headers(posts, has_more, after, before)
+    if fields is not None:
+        # The cursors' columns are always selected, but only the requested fields are sent
+        posts = narrow_rows(posts, fields)
+    return orjson.dumps(posts), headers
+
+
+async def ensure_course_exists(session: AsyncSession, course: CourseRecord) -> None:
+    """Check that a cached course still exists, once the request's writes to it are made.
+
+    The course may have been deleted since it was cached, e.g. by another worker process,
+    whose cache isn't invalidated by the deletion. SQLite doesn't enforce the foreign keys
+    of posts, so this is checked after the first write, when the transaction holds the
+    write lock and the course can no longer be deleted before it commits.
+    """
+    if (await session.exec(select(Course.id).where(Course.id == course.id))).first() is None:
+        await session.rollback()
+        course_cache.invalidate(course.title)
+        raise HTTPException(status_code=404, detail="Course not found")
+
+
+async def publish_approvals(
+        session: AsyncSession,
+        event_type: str,
+        post_ids: list[int],
+        course_id: Optional[int] = None
+        ) -> None:
+    """Publish the current approvers of each post, once the change has been committed.
+
+    The approvers are only queried if anyone is subscribed to the posts' course, or to any
+    course when the course isn't known.
+    """
+    if not post_ids or not course_events.has_subscribers(course_id):
+        return
+    for summary in await session.run_sync(get_approval_summaries, post_ids):
+        course_events.publish(summary['course_id'], event_type, summary)
+
+
 @app.post("/courses/create")
 async def create_course(
     new_course: Course,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
     user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
 ):
     new_course.author_id = user_id
     session.add(new_course)
-    session.commit()
+    try:
+        await session.flush()
+        await session.run_sync(bump_versions, [new_course.id])
+        await session.run_sync(record_course_change, ChangeType.course_created, new_course.id, new_course.title)
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail="Course already exists")
+    course_cache.invalidate(new_course.title)
     return {"message": "Course created"}
 
 
@@ -135,74 +278,240 @@ async def create_course(
 async def create_post(
     course_title: str,
     new_post: Post,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
     user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
 ):
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
     new_post.author_id = user_id
-    new_post.course_id = session.exec(select(Course.id).where(Course.title == course_title)).first()
+    new_post.course_id = course.id
+    new_post.approval_count = 0
+    new_post.approver_usernames = []
     session.add(new_post)
-    session.commit()
+    await session.flush()
+    await session.run_sync(index_post, new_post)
+    await session.run_sync(bump_versions, [course.id])
+    await session.run_sync(record_post_changes, ChangeType.post_created, [new_post.id])
+    await ensure_course_exists(session, course)
+    await session.commit()
+    if course_events.has_subscribers(course.id):
+        course_events.publish(
+            course.id, EventType.post_created, await session.run_sync(get_post_summary, new_post.id))
     return {"message": "Post created"}
 
 
+@app.post("/courses/{course_title}/posts/bulk")
+async def bulk_create_posts(
+    course_title: str,
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
+    user_id: int = Depends(ensure_user_role([UserRole.teacher, UserRole.admin]))
+) -> BulkPostsResponse:
+    """Create many posts in one transaction, e.g. when importing a course's material.
+
+    The body is either a JSON array of posts, or newline-delimited JSON (with a
+    `Content-Type` of `application/x-ndjson`) with one post per line. Every valid post
+    is created, and the result for each post is returned in the order they were sent.
+    """
+    started = time.perf_counter()
+    body = await request.body()
+    if request.headers.get("content-type", "").split(";")[0].strip() in NDJSON_MEDIA_TYPES:
+        items = parse_ndjson(body)
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of posts, or NDJSON")
+    if len(items) > MAX_BULK_POSTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_POSTS} posts can be created at once")
+
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    valid, failed = validate_posts(items)
+    created = await session.run_sync(insert_posts, course.id, user_id, valid)
+    # Nothing changes if no post was valid, so the course's ETags are left as they are
+    if created:
+        await session.run_sync(bump_versions, [course.id])
+        await session.run_sync(record_post_changes, ChangeType.post_created, [result.id for result in created])
+        await ensure_course_exists(session, course)
+        await session.commit()
+        # Too many posts to send one at a time, so subscribers reload the list instead
+        course_events.publish(course.id, EventType.resync, {'course_id': course.id})
+
+    elapsed = time.perf_counter() - started
+    return BulkPostsResponse(
+        created=len(created),
+        failed=len(failed),
+        elapsed_ms=round(elapsed * 1000, 3),
+        posts_per_second=round(len(created) / elapsed, 1),
+        results=sorted(created + failed, key=lambda result: result.index)
+    )
+
+
 @app.post("/courses/{course_title}/delete")
 async def delete_course(
     course_title: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
     user_id: int = Depends(ensure_user_role([UserRole.admin]))
 ):
-    course = session.exec(select(Course).where(Course.title == course_title)).first()
+    course = await course_cache.get_async(session, course_title)
     if course:
-        session.exec(
-            delete(Course).where(Course.title == course_title)
+        await session.run_sync(unindex_course, course.id)
+        deleted = await session.exec(
+            delete(Course).where(Course.id == course.id)
         )
-        session.commit()
-        return {"message": "Course deleted"}
-    else:
+        await session.run_sync(bump_versions, [course.id])
+        if deleted.rowcount:
+            await session.run_sync(record_course_change, ChangeType.course_deleted, course.id, course.title)
+        await session.commit()
+        # Only evicted once committed, so a lookup made while deleting can't cache it again
+        course_cache.invalidate(course_title)
+        if deleted.rowcount:
+            course_events.close_course(course.id)
+            return {"message": "Course deleted"}
+    raise HTTPException(status_code=404, detail="Course not found")
+
+
+@app.post("/courses/{course_title}/posts/approvals")
+async def update_approvals(
+    course_title: str,
+    changes: ApprovalChanges,
+    session: AsyncSession = Depends(get_async_session),
+    user_id: int = Depends(ensure_user_role([UserRole.teacher, UserRole.admin]))
+) -> ApprovalChangesResult:
+    """Approve and unapprove many posts of a course at once. Both are idempotent, so
+    approving a post twice, or unapproving a post which isn't approved, has no effect."""
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
         raise HTTPException(status_code=404, detail="Course not found")
 
+    requested = set(changes.approve) | set(changes.unapprove)
+    found = set((await session.exec(
+        select(Post.id).where(Post.id.in_(requested), Post.course_id == course.id)
+    )).all())
+    approved = await session.run_sync(approve_posts, user_id, [i for i in changes.approve if i in found], course.id)
+    unapproved = await session.run_sync(unapprove_posts, user_id, [i for i in changes.unapprove if i in found])
+    if approved or unapproved:
+        await session.run_sync(bump_versions, [course.id])
+        await session.run_sync(record_post_changes, ChangeType.post_approved, approved)
+        await session.run_sync(record_post_changes, ChangeType.post_unapproved, unapproved)
+        await ensure_course_exists(session, course)
+    await session.commit()
+    await publish_approvals(session, EventType.post_approved, approved, course.id)
+    await publish_approvals(session, EventType.post_unapproved, unapproved, course.id)
+    return ApprovalChangesResult(
+        approved=sorted(approved),
+        unapproved=sorted(unapproved),
+        not_found=sorted(requested - found)
+    )
+
 
 @app.post("/courses/{course_title}/posts/{post_id}/approve")
 async def approve_post(
     post_id: int,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
     user_id: int = Depends(ensure_user_role([UserRole.teacher, UserRole.admin]))
 ):
-    post = session.exec(
-        select(Post)
-        .where(Post.id == post_id)
-    ).first()
-    if post:
-        approval = Approval(post_id=post_id, user_id=user_id)
-        session.add(approval)
-        session.commit()
+    approved = await session.run_sync(approve_posts, user_id, [post_id])
+    if approved:
+        await session.run_sync(bump_post_versions, approved)
+        await session.run_sync(record_post_changes, ChangeType.post_approved, approved)
+        await session.commit()
+        await publish_approvals(session, EventType.post_approved, approved)
         return {"message": "Post approved"}
-    else:
-        raise HTTPException(status_code=404, detail="Post not found")
+    # Nothing was written, either because the post was already approved, or doesn't exist
+    if (await session.exec(select(Post.id).where(Post.id == post_id))).first() is not None:
+        return {"message": "Post approved"}
+    raise HTTPException(status_code=404, detail="Post not found")
+
+
+@app.post("/courses/{course_title}/posts/{post_id}/unapprove")
+async def unapprove_post(
+    post_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    user_id: int = Depends(ensure_user_role([UserRole.teacher, UserRole.admin]))
+):
+    unapproved = await session.run_sync(unapprove_posts, user_id, [post_id])
+    if unapproved:
+        await session.run_sync(bump_post_versions, unapproved)
+        await session.run_sync(record_post_changes, ChangeType.post_unapproved, unapproved)
+        await session.commit()
+        await publish_approvals(session, EventType.post_unapproved, unapproved)
+    return {"message": "Post unapproved"}
 
 
 # This route is protected by the OAuth2 scheme. The user must be logged in to access this route.
 @app.get("/courses")
 async def get_courses(
-    session: Session = Depends(get_session),
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_session),
     user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
 ):
-    courses = session.exec(select(Course)).all()
+    """Return every course. With `fields`, a comma separated list of course fields, only
+    those fields of each course are selected and returned."""
+    try:
+        fields = parse_fields(fields, Course)
+    except InvalidFields as error:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {error}")
+    global_version, _ = await session.run_sync(get_versions)
+    cached = not_modified(request, response, make_etag("courses", global_version, fields))
+    if cached:
+        return cached
+
+    if fields is not None:
+        courses = await session.run_sync(get_course_rows, fields)
+        return Response(orjson.dumps(courses), media_type="application/json", headers=response.headers)
+
+    courses = (await session.exec(select(Course).order_by(Course.id))).all()
 
     return courses
 
 
+@app.get("/changes")
+async def changes(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_async_read_session),
+    user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
+) -> ChangeFeed:
+    """Return the changes to courses and posts after the sequence number `since`, oldest first.
+
+    A client keeps the `next` of each response, and passes it as `since` to fetch only
+    what changed since. Without `since`, or once the changes after it have been trimmed
+    from the log, `reset` is set: the client should download every course again, and then
+    continue from `next`.
+    """
+    return await session.run_sync(get_changes, since, limit)
+
+
 @app.get("/courses/{course_title}/posts/{post_id}")
 async def get_post(
     course_title: str,
     post_id: int,
-    session: Session = Depends(get_session),
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_read_session),
     user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
 ):
-    post = session.exec(
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    _, course_version = await session.run_sync(get_versions, course.id)
+    cached = not_modified(request, response, make_etag("post", course.id, course_version, post_id))
+    if cached:
+        return cached
+
+    post = (await session.exec(
         select(Post)
-        .where(Post.id == post_id)
-    ).first()
+        .where(Post.id == post_id, Post.course_id == course.id)
+    )).first()
     if post:
         return post
     else:
@@ -212,43 +521,218 @@ async def get_post(
 @app.get("/courses/{course_title}/posts")
 async def get_course_posts(
     course_title: str,
-    session: Session = Depends(get_session),
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    order: SortOrder = SortOrder.oldest,
+    summary: bool = False,
+    fields: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_read_session),
     user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
-) -> list[PostWithAuthor]:
-    course = session.exec(
-        select(Course)
-        .options(
-            joinedload(Course.posts).
-            joinedload(Post.author),
-            joinedload(Course.posts)
-            .joinedload(Post.approvals)
-            .joinedload(Approval.user))
-        .where(Course.title == course_title)
-    ).first()
-    if course:
-        # Return a list of posts with the author's username
-        return [{**post.model_dump(),
-                 'author_username': post.author.username,
-                 'approvers': [approval.user.username for approval in post.approvals]} for post in course.posts]
-    else:
+) -> Union[list[PostSummary], list[PostWithAuthor]]:
+    """Return one page of a course's posts, ordered by `(created_at, id)`.
+
+    With `summary`, each post has the start of its content and the content's length in
+    place of the full content, which can be fetched with `get_post`.
+
+    With `fields`, a comma separated list of fields of `PostWithAuthor` (or of `PostSummary`
+    with `summary`), only those fields of each post are selected and returned.
+
+    Pages are selected with keyset pagination, so the cost of a page does not depend on
+    the number of posts in the course. The cursors for the neighbouring pages are sent
+    in the `X-Next-Cursor` and `X-Prev-Cursor` headers, and can be passed back as
+    `after` and `before` respectively.
+
+    The response's ETag changes whenever the course is written to. A request whose
+    `If-None-Match` has the current ETag is answered with 304, without querying the posts.
+    Concurrent requests for the same page of the same version of the course are coalesced.
+    """
+    if after is not None and before is not None:
+        raise HTTPException(status_code=400, detail="Only one of 'after' and 'before' may be given")
+    try:
+        after_cursor = Cursor.decode(after)
+        before_cursor = Cursor.decode(before)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        fields = parse_fields(fields, PostSummary if summary else PostWithAuthor)
+    except InvalidFields as error:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {error}")
+
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    _, course_version = await session.run_sync(get_versions, course.id)
+    etag = make_etag("posts", course.id, course_version, limit, after, before, order.value, summary, fields)
+    cached = not_modified(request, response, etag)
+    if cached:
+        return cached
+
+    # Identical requests for the same version of the course share one query, and its serialized result
+    body, headers = await course_post_flights.do(etag, lambda: render_course_post_page(
+        session.bind, course.id, limit, after_cursor, before_cursor, order, summary, fields))
+    return Response(body, media_type="application/json", headers={**response.headers, **headers})
+
+
+@app.get("/courses/{course_title}/page")
+async def course_page(
+    course_title: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    order: SortOrder = SortOrder.oldest,
+    summary: bool = False,
+    session: AsyncSession = Depends(get_async_read_session),
+    token_data: TokenData = Depends(ensure_user_token([UserRole.user, UserRole.teacher, UserRole.admin]))
+) -> CoursePageSchema:
+    """Return everything needed to open a course in one request: the course, the user's
+    login status, and the first page of the course's posts.
+
+    The posts are paged as by `get_course_posts`, and the cursor of the next page is sent
+    in the `X-Next-Cursor` header. The user is read from their token where it carries
+    their display fields, and the rest is selected in one pass through the session.
+    """
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
         raise HTTPException(status_code=404, detail="Course not found")
 
+    global_version, course_version = await session.run_sync(get_versions, course.id)
+    etag = make_etag("page", course.id, global_version, course_version, token_data.user_id,
+                     limit, order.value, summary)
+    cached = not_modified(request, response, etag)
+    if cached:
+        return cached
+
+    user_id = None if token_data.has_current_claims else token_data.user_id
+    page = await session.run_sync(get_course_page, course.id, limit, order, summary, user_id)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    course_row, user_row, posts, has_more = page
+    user = UserStatusSchema(
+        logged_in=True, **(user_row or token_data.model_dump(include={'username', 'email', 'role'})))
+    body = orjson.dumps({'course': course_row, 'user': user.model_dump(mode="json"), 'posts': posts})
+    return Response(body, media_type="application/json",
+                    headers={**response.headers, **page_cursor_headers(posts, has_more, None, None)})
+
+
+@app.get("/courses/{course_title}/export")
+async def export_course_posts(
+    course_title: str,
+    export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format"),
+    session: AsyncSession = Depends(get_async_read_session),
+    user_id: int = Depends(ensure_user_role([UserRole.teacher, UserRole.admin]))
+):
+    """Download every post of a course, oldest first, as NDJSON or CSV.
+
+    The posts are streamed from a database cursor as they are read, so the memory used
+    doesn't grow with the size of the course.
+    """
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    filename = quote(f"{course.title}.{export_format.value}", safe='')
+    return StreamingResponse(
+        stream_course_posts(session.bind, course.id, export_format),
+        media_type=export_format.media_type,
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
+    )
+
+
+@app.get("/courses/{course_title}/events")
+async def course_events_stream(
+    course_title: str,
+    session: AsyncSession = Depends(get_async_read_session),
+    user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
+):
+    """Stream changes to a course's posts as server-sent events, so clients can update
+    their post list in place instead of reloading it.
+
+    The events are `post-created` (the post's summary), `post-approved` and
+    `post-unapproved` (the post's id and current approvers), `course-deleted`, after
+    which the stream ends, and `resync`, when the client has missed events and should
+    reload the posts.
+    """
+    course = await course_cache.get_async(session, course_title)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return StreamingResponse(
+        course_events.stream(course.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/search")
+async def search(
+    q: str,
+    course: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_async_read_session),
+    user_id: int = Depends(ensure_user_role([UserRole.user, UserRole.teacher, UserRole.admin]))
+) -> list[SearchResult]:
+    """Search the title, description and content of posts, optionally within one course.
+    Results are ranked best match first.
+    """
+    course_id = None
+    if course is not None:
+        course_record = await course_cache.get_async(session, course)
+        if course_record is None:
+            raise HTTPException(status_code=404, detail="Course not found")
+        course_id = course_record.id
+    return await session.run_sync(search_posts, q, course_id, limit, offset)
+
+
+@app.get("/metrics")
+async def metrics(
+    session: AsyncSession = Depends(get_async_session),
+    read_session: AsyncSession = Depends(get_async_read_session)
+):
+    """Metrics of this worker process in the Prometheus text format: requests, latency and
+    database queries by route, and the state of the caches and connection pools.
+
+    The sessions are only used for their engines, so no connection is checked out.
+    """
+    engines = {'write': session.bind}
+    if read_session.bind is not session.bind:
+        engines['read'] = read_session.bind
+    pools = [({'engine': name}, stats) for name, engine in engines.items() if (stats := pool_stats(engine.sync_engine))]
+
+    lines = [
+        *render_request_metrics(request_metrics),
+        *render_stats("db_pool", "Database connection pool", pools),
+        *render_stats("token_cache", "Verified session token cache", [({}, token_cache.stats())]),
+        *render_stats("course_cache", "Course title lookup cache", [({}, course_cache.stats())]),
+        *render_stats("post_list_flights", "Coalesced post list reads", [({}, course_post_flights.stats())]),
+        *render_stats("course_events", "Live course event streams", [({}, course_events.stats())]),
+        *render_stats("password_hash", "Password hashing thread pool", [({}, passwords.stats())]),
+    ]
+    return Response("\n".join(lines) + "\n", media_type=METRICS_CONTENT_TYPE)
+
 
 @app.get("/verify-token")
 async def verify_token(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_read_session),
     access_token: Annotated[Union[str, None],
                             Depends(optional_oauth2_scheme)] = None
 ):
     """
     While the client is running, they can call this to check if they are logged in.
     It also sends the username and email of the user if they are logged in.
+    These are read from the token itself, unless it was issued with an older version
+    of its claims, in which case the user is looked up.
     """
     if access_token:
         token_data = UserSessionManager.decode_jwt(access_token)
         if token_data:
             user_id = token_data.user_id
             print(f"User ID: {user_id}")
+            if token_data.has_current_claims:
+                return UserStatusSchema(
+                    logged_in=True, username=token_data.username, email=token_data.email, role=token_data.role)
             return await get_user_data(user_id, session)
 
     return UserStatusSchema(logged_in=False)
@@ -259,15 +743,18 @@ async def verify_token(
 async def login(
     user_data: UserLoginSchema,
     response: Response,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     username = user_data.username
     password = user_data.password
     print(f"Received data: {user_data}")
-    user = session.exec(select(User)
-                        .where(User.username == username, User.password == password)).first()
-    if user:
-        jwt_token = UserSessionManager.sign_jwt(user.id, user.role)
+    user = (await session.exec(select(User).where(User.username == username))).first()
+    valid, new_hash = await verify_password(password, user.password if user else None)
+    if valid:
+        if new_hash:
+            user.password = new_hash
+            await session.commit()
+        jwt_token = UserSessionManager.sign_jwt(user.id, user.role, user.username, user.email)
         response.set_cookie(
             key='access_token',
             value=f"Bearer {jwt_token}",
@@ -285,7 +772,12 @@ async def login(
 
 # Log the user out by deleting their session token from their cookies
 @app.post("/logout")
-async def logout(response: Response):
+async def logout(
+    response: Response,
+    access_token: Annotated[Union[str, None], Depends(optional_oauth2_scheme)] = None
+):
+    if access_token:
+        UserSessionManager.revoke_jwt(access_token)
     response.delete_cookie(key='access_token')
     return {'message': 'logged out', 'code': 0, 'logged_in': False}
 
@@ -294,30 +786,35 @@ async def logout(response: Response):
 @app.post('/register')
 async def register(
     user_data: UserRegisterSchema,
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    user = session.exec(select(User).where(User.username == user_data.username)).first()
+    user = (await session.exec(select(User).where(User.username == user_data.username))).first()
     if user:
         return {'message': 'User already exists', 'code': 1}
     new_user = User(
         username=user_data.username,
-        password=user_data.password,
+        password=await hash_password(user_data.password),
         email=user_data.email,
         role=UserRole.user
     )
     session.add(new_user)
-    session.commit()
+    await session.run_sync(bump_versions)
+    await session.commit()
     return {'message': 'User created', 'code': 0}
 
 
 @app.post('/admin/delete-user')
 async def delete_user(
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
     user_id: int = Depends(ensure_user_role([UserRole.admin]))
 ):
-    user = session.exec(select(User).where(User.id == user_id)).first()
+    user = (await session.exec(select(User).where(User.id == user_id))).first()
     if user:
-        session.delete(user)
-        session.commit()
+        await session.delete(user)
+        # The user's posts drop out of every post list, since they are joined to their author
+        await session.run_sync(bump_all_versions)
+        await session.run_sync(record_resync)
+        await session.commit()
+        token_cache.revoke_user(user.id)
         return {'message': 'User deleted', 'code': 0}
     return {'message': 'User not found', 'code': 1}
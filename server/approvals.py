@@ -0,0 +1,112 @@
+"""
+server/approvals.py
+
+Maintain the approval summary denormalized onto each post.
+"""
+
+import datetime
+import json
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import delete, func, literal, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from server.models import Approval, Post, User
+
+
+def _approval_count():
+    return (
+        select(func.count(Approval.id))
+        .where(Approval.post_id == Post.id)
+        .scalar_subquery()
+    )
+
+
+def _approver_usernames():
+    approvers = (
+        select(User.username)
+        .join(Approval, Approval.user_id == User.id)
+        .where(Approval.post_id == Post.id)
+        .order_by(Approval.id)
+        .correlate(Post)
+        .subquery()
+    )
+    return select(func.json_group_array(approvers.c.username)).scalar_subquery()
+
+
+def refresh_approval_summary(session: Session, post_ids: Optional[Iterable[int]] = None) -> None:
+    """Recompute `Post.approval_count` and `Post.approver_usernames` from the approval table.
+
+    This must be called in the same transaction as any change to a post's approvals.
+    When no post ids are given, every post is refreshed.
+    """
+    statement = update(Post).values(
+        approval_count=_approval_count(),
+        approver_usernames=_approver_usernames()
+    )
+    if post_ids is not None:
+        statement = statement.where(Post.id.in_(list(post_ids)))
+    session.exec(statement)
+
+
+def find_inconsistent_posts(session: Session) -> list[int]:
+    """Return the ids of posts whose approval summary doesn't match their approvals"""
+    rows = session.exec(
+        select(Post.id, Post.approval_count, Post.approver_usernames,
+               _approval_count(), _approver_usernames())
+        .order_by(Post.id)
+        .execution_options(yield_per=1000)
+    )
+    return [
+        post_id
+        for post_id, count, usernames, actual_count, actual_usernames in rows
+        if count != actual_count or usernames != json.loads(actual_usernames)
+    ]
+
+
+def approve_posts(session: Session, user_id: int, post_ids: list[int], course_id: Optional[int] = None) -> list[int]:
+    """Record the user's approval of each existing post, skipping any they already approved.
+
+    The approvals are written by a single `INSERT ... SELECT ... ON CONFLICT DO NOTHING`,
+    so approving a post twice is not an error. Returns the ids of the newly approved posts.
+    """
+    existing = select(Post.id, literal(user_id), literal(datetime.datetime.now())).where(Post.id.in_(post_ids))
+    if course_id is not None:
+        existing = existing.where(Post.course_id == course_id)
+    statement = (
+        insert(Approval)
+        .from_select(["post_id", "user_id", "created_at"], existing)
+        .on_conflict_do_nothing(index_elements=["post_id", "user_id"])
+        .returning(Approval.post_id)
+    )
+    approved = list(session.exec(statement).scalars().all())
+    if approved:
+        refresh_approval_summary(session, approved)
+    return approved
+
+
+def unapprove_posts(session: Session, user_id: int, post_ids: list[int]) -> list[int]:
+    """Remove the user's approval of each post. Returns the ids of the posts which had been approved."""
+    statement = (
+        delete(Approval)
+        .where(Approval.user_id == user_id, Approval.post_id.in_(post_ids))
+        .returning(Approval.post_id)
+    )
+    unapproved = list(session.exec(statement).scalars().all())
+    if unapproved:
+        refresh_approval_summary(session, unapproved)
+    return unapproved
+
+
+def get_approval_summaries(session: Session, post_ids: list[int]) -> list[dict[str, Any]]:
+    """Return the course and the current approvers of each post"""
+    if not post_ids:
+        return []
+    rows = session.exec(
+        select(Post.id, Post.course_id, Post.approver_usernames).where(Post.id.in_(post_ids))
+    ).all()
+    return [
+        {'id': post_id, 'course_id': course_id, 'approvers': approvers}
+        for post_id, course_id, approvers in rows
+    ]
@@ -0,0 +1,86 @@
+"""
+server/bulk.py
+
+Batched writes, for importing many rows in a single request.
+"""
+
+import datetime
+import json
+from typing import Any
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from server.models import BulkPostResult, Post, PostCreate
+from server.search import index_posts
+
+
+# Rows inserted per INSERT statement. SQLite allows at most 32766 bound parameters per statement.
+INSERT_CHUNK_SIZE = 500
+MAX_BULK_POSTS = 10000
+
+
+def parse_ndjson(body: bytes) -> list[Any]:
+    """Split a newline-delimited JSON body into items. Lines which aren't valid JSON are
+    returned as `None`, so they are reported as invalid posts in the same position."""
+    items = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            items.append(None)
+    return items
+
+
+def validate_posts(items: list[Any]) -> tuple[list[tuple[int, PostCreate]], list[BulkPostResult]]:
+    """Validate each item as a new post. Returns the valid posts along with their position,
+    and a failed result for each invalid item."""
+    valid = []
+    failed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            failed.append(BulkPostResult(index=index, created=False, errors=["Expected a JSON object"]))
+            continue
+        try:
+            valid.append((index, PostCreate.model_validate(item)))
+        except ValidationError as e:
+            errors = [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+            failed.append(BulkPostResult(index=index, created=False, errors=errors))
+    return valid, failed
+
+
+def insert_posts(
+        session: Session,
+        course_id: int,
+        author_id: int,
+        posts: list[tuple[int, PostCreate]]
+        ) -> list[BulkPostResult]:
+    """Insert validated posts in batches of `INSERT_CHUNK_SIZE`, within the session's transaction"""
+    created_at = datetime.datetime.now()
+    statement = insert(Post).returning(Post.id, sort_by_parameter_order=True)
+    results = []
+    for start in range(0, len(posts), INSERT_CHUNK_SIZE):
+        chunk = posts[start:start + INSERT_CHUNK_SIZE]
+        rows = [
+            {
+                **post.model_dump(),
+                'created_at': created_at,
+                'author_id': author_id,
+                'course_id': course_id,
+                'approval_count': 0,
+                'approver_usernames': [],
+            }
+            for _, post in chunk
+        ]
+        ids = session.exec(statement, params=rows).scalars().all()
+        for row, post_id in zip(rows, ids):
+            row['id'] = post_id
+        index_posts(session, rows)
+        results.extend(
+            BulkPostResult(index=index, created=True, id=post_id)
+            for (index, _), post_id in zip(chunk, ids)
+        )
+    return results
@@ -0,0 +1,84 @@
+"""
+server/cache.py
+
+In-process caches for data that is read on almost every request but rarely written.
+"""
+
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from server.models import Course
+
+
+class CourseRecord(NamedTuple):
+    """The small subset of a course needed to serve course-scoped requests"""
+    id: int
+    title: str
+    author_id: int
+
+
+class CourseCache:
+    """Bounded LRU cache resolving course titles (the URL slug) to course records.
+
+    Only courses that exist are cached. Every write which adds, removes or renames a
+    course must call `invalidate` for the affected title once it's committed, since a
+    lookup made before then caches the course as it was. Other worker processes keep
+    their entries, so writes to a cached course check that it still exists.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._records: OrderedDict[str, CourseRecord] = OrderedDict()
+
+    def get(self, session: Session, title: str) -> Optional[CourseRecord]:
+        record = self._hit(title)
+        if record is None:
+            record = self._load(session, title)
+        return record
+
+    async def get_async(self, session: AsyncSession, title: str) -> Optional[CourseRecord]:
+        """Same as `get`, but only awaits the database on a miss"""
+        record = self._hit(title)
+        if record is None:
+            record = await session.run_sync(self._load, title)
+        return record
+
+    def _hit(self, title: str) -> Optional[CourseRecord]:
+        record = self._records.get(title)
+        if record is not None:
+            self._records.move_to_end(title)
+            self.hits += 1
+        return record
+
+    def _load(self, session: Session, title: str) -> Optional[CourseRecord]:
+        self.misses += 1
+        row = session.exec(
+            select(Course.id, Course.title, Course.author_id)
+            .where(Course.title == title)
+        ).first()
+        if row is None:
+            return None
+        record = CourseRecord(*row)
+        self._records[title] = record
+        if len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+        return record
+
+    def invalidate(self, title: str) -> None:
+        self._records.pop(title, None)
+
+    def clear(self) -> None:
+        self._records.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {'size': len(self._records), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+course_cache = CourseCache()
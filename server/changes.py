@@ -0,0 +1,91 @@
+"""
+server/changes.py
+
+A log of changes to courses and posts, from which clients which have been offline catch
+up without downloading every course again.
+
+Each write appends its changes to the log in the transaction of the write itself. SQLite
+allows one writer at a time, so entries are committed in the order of their sequence
+numbers, and a client which has read up to an entry will never miss one before it.
+Entries older than the retention period are trimmed by `compact_changes`; a client whose
+cursor is older than the log is told to download everything again.
+"""
+
+import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, func, insert, literal
+from sqlmodel import Session, select
+
+from server.models import Change, ChangeFeed, Course, Post
+
+
+# How long entries are kept, and so how long a client can be offline and still catch up
+CHANGE_RETENTION = datetime.timedelta(days=7)
+
+
+class ChangeType:
+    course_created = "course-created"
+    course_deleted = "course-deleted"
+    post_created = "post-created"
+    post_approved = "post-approved"
+    post_unapproved = "post-unapproved"
+    # Any course may have changed, e.g. a user and their posts were deleted
+    resync = "resync"
+
+
+def record_course_change(session: Session, change_type: str, course_id: int, course_title: str) -> None:
+    session.add(Change(type=change_type, course_id=course_id, course_title=course_title))
+
+
+def record_post_changes(session: Session, change_type: str, post_ids: Iterable[int]) -> None:
+    """Record a change to each of the given posts, in the order of their ids"""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    changes = (
+        select(literal(change_type), Post.course_id, Course.title, Post.id, literal(datetime.datetime.now()))
+        .join(Course, Course.id == Post.course_id)
+        .where(Post.id.in_(post_ids))
+        .order_by(Post.id)
+    )
+    session.exec(insert(Change).from_select(
+        ["type", "course_id", "course_title", "post_id", "created_at"], changes))
+
+
+def record_resync(session: Session) -> None:
+    session.add(Change(type=ChangeType.resync, course_id=0, course_title=""))
+
+
+def get_changes(session: Session, since: Optional[int], limit: int) -> ChangeFeed:
+    """Return up to `limit` changes after the sequence number `since`.
+
+    A client without a cursor, or whose cursor is older than the log, is told to reset:
+    download everything, then continue from the latest change. So is a client whose cursor
+    is ahead of the log, e.g. from before the database was restored, since it would
+    otherwise never be sent the changes it hasn't seen.
+    """
+    first, last = session.exec(select(func.min(Change.seq), func.max(Change.seq))).one()
+    if since is None or since > (last or 0) or (first is not None and since < first - 1):
+        return ChangeFeed(changes=[], next=last or 0, more=False, reset=True)
+
+    changes = list(session.exec(
+        select(Change).where(Change.seq > since).order_by(Change.seq).limit(limit + 1)
+    ).all())
+    more = len(changes) > limit
+    changes = changes[:limit]
+    return ChangeFeed(changes=changes, next=changes[-1].seq if changes else since, more=more)
+
+
+def compact_changes(session: Session, retention: datetime.timedelta = CHANGE_RETENTION) -> int:
+    """Trim entries older than the retention period. Returns the number trimmed.
+
+    The latest entry is always kept, so that the log still records how far it has been
+    trimmed, and cursors from before then can be told apart from cursors which are current.
+    """
+    latest = select(func.max(Change.seq)).scalar_subquery()
+    trimmed = session.exec(
+        delete(Change)
+        .where(Change.created_at < datetime.datetime.now() - retention, Change.seq < latest)
+    )
+    return trimmed.rowcount
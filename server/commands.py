@@ -0,0 +1,104 @@
+"""
+server/commands.py
+
+Maintenance commands for an existing database. Run with `python -m server.commands --help`.
+"""
+
+import argparse
+import datetime
+
+from sqlmodel import Session
+
+from server.approvals import find_inconsistent_posts, refresh_approval_summary
+from server.changes import CHANGE_RETENTION, compact_changes
+from server.compression import compress_existing_content, stored_content_size
+from server.search import rebuild_index
+from server.versions import bump_post_versions
+
+
+def check_approvals(session: Session, fix: bool) -> int:
+    """Compare each post's approval summary against the approval table"""
+    post_ids = find_inconsistent_posts(session)
+    if not post_ids:
+        print("All post approval summaries are consistent")
+        return 0
+    print(f"{len(post_ids)} post(s) have an inconsistent approval summary: {post_ids}")
+    if fix:
+        refresh_approval_summary(session, post_ids)
+        bump_post_versions(session, post_ids)
+        session.commit()
+        print(f"Rebuilt the approval summary of {len(post_ids)} post(s)")
+        return 0
+    return 1
+
+
+def rebuild_search(session: Session) -> int:
+    """Repopulate the full-text search index from the post table"""
+    indexed = rebuild_index(session)
+    session.commit()
+    print(f"Indexed {indexed} post(s) for search")
+    return 0
+
+
+def compress_content(session: Session, vacuum: bool) -> int:
+    """Store each post's content in the form chosen by the current compression settings"""
+    size_before = stored_content_size(session)
+    rewritten = compress_existing_content(session)
+    session.commit()
+    size_after = stored_content_size(session)
+    print(f"Rewrote the content of {rewritten} post(s)")
+    print(f"Stored content: {size_before} bytes -> {size_after} bytes, saved {size_before - size_after} bytes")
+    if vacuum:
+        # Return the freed pages to the filesystem. VACUUM can't run inside a transaction.
+        with session.bind.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+        print("Vacuumed the database")
+    return 0
+
+
+def compact_change_log(session: Session, keep_days: float) -> int:
+    """Trim entries from the change log which are older than the retention period"""
+    trimmed = compact_changes(session, datetime.timedelta(days=keep_days))
+    session.commit()
+    print(f"Trimmed {trimmed} change log entr{'y' if trimmed == 1 else 'ies'} older than {keep_days:g} day(s)")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m server.commands", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_approvals_parser = subparsers.add_parser(
+        "check-approvals", help="Check the approval summary denormalized onto each post")
+    check_approvals_parser.add_argument(
+        "--fix", action="store_true", help="Rebuild the summary of any inconsistent posts")
+
+    subparsers.add_parser("rebuild-search", help="Rebuild the full-text search index over posts")
+
+    compress_content_parser = subparsers.add_parser(
+        "compress-content", help="Compress existing post content, and report the space saved")
+    compress_content_parser.add_argument(
+        "--vacuum", action="store_true", help="Shrink the database file afterwards")
+
+    compact_changes_parser = subparsers.add_parser(
+        "compact-changes", help="Trim old entries from the change log")
+    compact_changes_parser.add_argument(
+        "--keep-days", type=float, default=CHANGE_RETENTION.days,
+        help="Keep entries this many days old or newer (default: %(default)s)")
+
+    args = parser.parse_args(argv)
+
+    from server.db import engine
+    with Session(engine) as session:
+        if args.command == "check-approvals":
+            return check_approvals(session, args.fix)
+        if args.command == "rebuild-search":
+            return rebuild_search(session)
+        if args.command == "compress-content":
+            return compress_content(session, args.vacuum)
+        if args.command == "compact-changes":
+            return compact_change_log(session, args.keep_days)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
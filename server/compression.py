@@ -0,0 +1,126 @@
+"""
+server/compression.py
+
+Transparent compression of large post content at rest.
+
+Content of at least `COMPRESSION_THRESHOLD` bytes is stored as a blob holding a codec
+marker, the length of the content in characters, and the compressed content, e.g.
+`b"zlib:20000:<compressed bytes>"`. Shorter content is stored as plain text, as are
+all values on databases other than SQLite, where a text column can't hold a blob.
+"""
+
+import zlib
+from typing import Optional
+
+from sqlalchemy import String, text
+from sqlalchemy.types import TypeDecorator
+from sqlmodel import Session
+
+
+# Content of at least this many UTF-8 encoded bytes is compressed
+COMPRESSION_THRESHOLD = 1024
+ZLIB_LEVEL = 6
+ZLIB_CODEC = b"zlib"
+HEADER_SEPARATOR = b":"
+
+# Rows read and rewritten at a time by `compress_existing_content`
+COMPACTION_BATCH_SIZE = 500
+
+
+def encode_content(content: Optional[str]) -> Optional[str | bytes]:
+    """Return the stored form of `content`: compressed if it's large enough to be worth it"""
+    if content is None:
+        return None
+    encoded = content.encode()
+    if len(encoded) < COMPRESSION_THRESHOLD:
+        return content
+    stored = HEADER_SEPARATOR.join([
+        ZLIB_CODEC, str(len(content)).encode(), zlib.compress(encoded, ZLIB_LEVEL)
+    ])
+    return stored if len(stored) < len(encoded) else content
+
+
+def _parse_header(stored: bytes) -> tuple[bytes, int, bytes]:
+    codec, length, payload = stored.split(HEADER_SEPARATOR, 2)
+    if codec != ZLIB_CODEC:
+        raise ValueError(f"Unknown content codec {codec!r}")
+    return codec, int(length), payload
+
+
+def decode_content(stored: Optional[str | bytes]) -> Optional[str]:
+    """Return the content held by a stored value, decompressing it if needed"""
+    if not isinstance(stored, bytes):
+        return stored
+    _, _, payload = _parse_header(stored)
+    return zlib.decompress(payload).decode()
+
+
+def summarize_content(
+        prefix: Optional[str | bytes],
+        length: Optional[int],
+        preview_length: int
+        ) -> tuple[Optional[str], int]:
+    """Return the first `preview_length` characters of the content and its length in characters.
+
+    `prefix` is the start of the stored value and `length` is the length of the stored
+    value, as measured by SQLite. A compressed value holds the content's length in its
+    header, and only as much of its prefix is decompressed as is needed for the preview.
+    """
+    if prefix is None:
+        return None, 0
+    if not isinstance(prefix, bytes):
+        return prefix[:preview_length], length
+    _, content_length, payload = _parse_header(prefix)
+    # A UTF-8 character is at most 4 bytes. A truncated stream decompresses as far as it goes.
+    preview = zlib.decompressobj().decompress(payload, 4 * preview_length)
+    return preview.decode(errors='ignore')[:preview_length], content_length
+
+
+class CompressedText(TypeDecorator):
+    """A text column whose large values are stored compressed, see `encode_content`"""
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name != "sqlite":
+            return value
+        return encode_content(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_content(value)
+
+
+def stored_content_size(session: Session) -> int:
+    """Total bytes of post content as stored, whether compressed or not. The search index
+    keeps no copy of the content, see `server.search`."""
+    return session.exec(text("SELECT coalesce(sum(length(CAST(content AS BLOB))), 0) FROM post")).one()[0]
+
+
+def compress_existing_content(session: Session) -> int:
+    """Rewrite the stored form of each post's content with the current compression settings,
+    within the session's transaction.
+
+    Compresses content stored before compression was enabled, and decompresses content
+    that no longer reaches the threshold. Returns the number of posts rewritten.
+    """
+    rewritten = 0
+    last_id = 0
+    while True:
+        rows = session.exec(
+            text(
+                "SELECT id, content FROM post WHERE id > :last_id AND content IS NOT NULL "
+                "ORDER BY id LIMIT :limit"
+            ),
+            params={'last_id': last_id, 'limit': COMPACTION_BATCH_SIZE}
+        ).all()
+        if not rows:
+            return rewritten
+        last_id = rows[-1][0]
+        changes = []
+        for post_id, stored in rows:
+            restored = encode_content(decode_content(stored))
+            if restored != stored:
+                changes.append({'id': post_id, 'content': restored})
+        if changes:
+            session.exec(text("UPDATE post SET content = :content WHERE id = :id"), params=changes)
+            rewritten += len(changes)
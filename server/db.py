@@ -4,14 +4,26 @@ server/db.py
 Setup a connection to the main database and create some sample data.
 """
 
-from sqlmodel import Session, create_engine, select
+from sqlmodel import Session, select
 
+from server.engine import make_async_engine, make_engine
 from server.models import User, Course, Post, UserRole
+from server.passwords import password_context
+from server.search import rebuild_index
+from server.settings import DatabaseSettings
 
 # Database Setup
-DATABASE_URL = "sqlite:///db.sqlite3"
+settings = DatabaseSettings.from_env()
 
-engine = create_engine(DATABASE_URL)
+# The synchronous engine is used for setup and maintenance commands. The API serves
+# requests through the async engine, so waiting on the database never blocks the event loop.
+engine = make_engine(settings)
+async_engine = make_async_engine(settings)
+
+# Read-only requests are served from a replica or a read-only pool when one is configured,
+# so they don't compete with writers for connections
+read_settings = settings.get_read_settings()
+async_read_engine = make_async_engine(read_settings) if read_settings else async_engine
 
 with Session(engine) as session:
 
@@ -19,9 +31,12 @@ with Session(engine) as session:
     if not session.exec(select(User)).first():
         session.add_all(
             [
-                User(username="admin", password="password", email="fred@example.com", role=UserRole.admin),
-                User(username="bob", password="1234", email="bob@example.com", role=UserRole.user),
-                User(username="alice", password="1234", email="alice@example.com", role=UserRole.teacher),
+                User(username="admin", password=password_context.hash("password"), email="fred@example.com",
+                     role=UserRole.admin),
+                User(username="bob", password=password_context.hash("1234"), email="bob@example.com",
+                     role=UserRole.user),
+                User(username="alice", password=password_context.hash("1234"), email="alice@example.com",
+                     role=UserRole.teacher),
             ]
         )
         session.commit()
@@ -102,4 +117,6 @@ with Session(engine) as session:
                 ),
             ]
         )
+        session.flush()
+        rebuild_index(session)
         session.commit()
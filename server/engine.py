@@ -0,0 +1,73 @@
+"""
+server/engine.py
+
+Create database engines from the server's settings.
+"""
+
+from typing import Any
+
+from sqlalchemy import Engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import create_engine
+
+from server.metrics import instrument_engine
+from server.settings import DatabaseSettings, SQLiteProfile
+
+
+def sqlite_pragmas(settings: DatabaseSettings) -> dict[str, Any]:
+    """The pragmas applied to every new SQLite connection under the configured profile"""
+    pragmas = {'busy_timeout': settings.sqlite_busy_timeout_ms}
+    if settings.sqlite_profile == SQLiteProfile.tuned:
+        # The journal mode is stored in the database file, so only writers can change it
+        if not settings.is_read_only:
+            pragmas['journal_mode'] = 'WAL'
+        pragmas.update({
+            # In WAL mode this can only lose the last transactions on power loss, never corrupt
+            'synchronous': 'NORMAL',
+            'cache_size': settings.sqlite_cache_size,
+            'mmap_size': settings.sqlite_mmap_size,
+            'temp_store': 'MEMORY',
+        })
+    return pragmas
+
+
+def _engine_options(settings: DatabaseSettings, url: str, overrides: dict[str, Any]) -> dict[str, Any]:
+    options = {'pool_pre_ping': settings.pool_pre_ping}
+    # In-memory SQLite databases use a single connection, rather than a sized pool.
+    # A pool class given by the caller may not be sized either.
+    if make_url(url).database not in (None, "", ":memory:") and 'poolclass' not in overrides:
+        options.update({
+            'pool_size': settings.pool_size,
+            'max_overflow': settings.max_overflow,
+            'pool_timeout': settings.pool_timeout,
+        })
+    return {**options, **overrides}
+
+
+def _apply_sqlite_pragmas(engine: Engine, settings: DatabaseSettings) -> None:
+    pragmas = sqlite_pragmas(settings)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def make_engine(settings: DatabaseSettings, **kwargs) -> Engine:
+    engine = create_engine(settings.url, **_engine_options(settings, settings.url, kwargs))
+    if settings.is_sqlite:
+        _apply_sqlite_pragmas(engine, settings)
+    instrument_engine(engine)
+    return engine
+
+
+def make_async_engine(settings: DatabaseSettings, **kwargs) -> AsyncEngine:
+    url = settings.get_async_url()
+    engine = create_async_engine(url, **_engine_options(settings, url, kwargs))
+    if settings.is_sqlite:
+        _apply_sqlite_pragmas(engine.sync_engine, settings)
+    instrument_engine(engine.sync_engine)
+    return engine
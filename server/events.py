@@ -0,0 +1,136 @@
+"""
+server/events.py
+
+Live updates to a course's posts, published by the write routes to subscribers of the
+course's server-sent event stream.
+
+The broker is in-process, so a subscriber only hears about writes handled by the same
+worker process.
+"""
+
+import asyncio
+import contextlib
+import itertools
+from typing import Any, AsyncGenerator, Iterator, NamedTuple, Optional
+
+import orjson
+
+
+# Events queued for a subscriber before it is considered too slow to keep up
+SUBSCRIBER_QUEUE_SIZE = 100
+# Seconds between comments sent to keep an idle stream open through proxies
+HEARTBEAT_INTERVAL = 15
+
+
+class EventType:
+    post_created = "post-created"
+    post_approved = "post-approved"
+    post_unapproved = "post-unapproved"
+    course_deleted = "course-deleted"
+    # The subscriber has missed events, and should reload the course's posts
+    resync = "resync"
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    data: Any
+
+    def encode(self) -> bytes:
+        return b"id: %d\nevent: %s\ndata: %s\n\n" % (self.id, self.type.encode(), orjson.dumps(self.data))
+
+
+class Subscription:
+    """A subscriber's queue of events. `None` is queued once the stream has ended."""
+
+    def __init__(self, course_id: int, max_queued: int):
+        self.course_id = course_id
+        # Room is always left for the final event and the end of the stream
+        self.queue: asyncio.Queue[Optional[Event]] = asyncio.Queue(max(max_queued, 2))
+
+    def _replace(self, *events: Optional[Event]) -> None:
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        for event in events:
+            self.queue.put_nowait(event)
+
+
+class EventBroker:
+    """Publishes each course's events to the subscribers of that course.
+
+    Publishing never waits for subscribers. When a subscriber's queue is full, its queued
+    events are replaced by a single `resync` event, so a slow client costs a bounded amount
+    of memory and reloads the posts once it catches up, rather than slowing down writes.
+    """
+
+    def __init__(self, max_queued: int = SUBSCRIBER_QUEUE_SIZE):
+        self.max_queued = max_queued
+        self.published = 0
+        self.dropped = 0
+        self._ids = itertools.count(1)
+        self._subscriptions: dict[int, set[Subscription]] = {}
+
+    @contextlib.contextmanager
+    def subscribe(self, course_id: int) -> Iterator[Subscription]:
+        subscription = Subscription(course_id, self.max_queued)
+        self._subscriptions.setdefault(course_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscriptions = self._subscriptions.get(course_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[course_id]
+
+    def has_subscribers(self, course_id: Optional[int] = None) -> bool:
+        """Whether anyone is subscribed to the course, or to any course if none is given, so
+        publishers can skip building events which no one would receive"""
+        if course_id is None:
+            return bool(self._subscriptions)
+        return course_id in self._subscriptions
+
+    def publish(self, course_id: int, event_type: str, data: Any) -> None:
+        event = Event(next(self._ids), event_type, data)
+        self.published += 1
+        for subscription in self._subscriptions.get(course_id, ()):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += subscription.queue.qsize() + 1
+                subscription._replace(Event(event.id, EventType.resync, {'course_id': course_id}))
+
+    async def stream(self, course_id: int) -> AsyncGenerator[bytes, None]:
+        """Subscribe to a course, and yield its events in the server-sent events format until
+        the stream ends. Comments are sent while there are no events, to keep it open."""
+        with self.subscribe(course_id) as subscription:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event.encode()
+
+    def close_course(self, course_id: int) -> None:
+        """Publish the deletion of a course, and end its subscribers' streams"""
+        event = Event(next(self._ids), EventType.course_deleted, {'course_id': course_id})
+        self.published += 1
+        for subscription in self._subscriptions.pop(course_id, ()):
+            subscription._replace(event, None)
+
+    def clear(self) -> None:
+        self.published = 0
+        self.dropped = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'subscribers': sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+            'published': self.published,
+            'dropped': self.dropped,
+        }
+
+
+course_events = EventBroker()
@@ -0,0 +1,84 @@
+"""
+server/export.py
+
+Stream every post of a course as NDJSON or CSV, without holding the course in memory.
+"""
+
+import csv
+import enum
+import io
+import json
+from typing import Any, AsyncGenerator
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from server.models import Post
+from server.queries import course_posts_query, post_row
+
+
+# Rows fetched from the database cursor, and written to the response, at a time
+EXPORT_BATCH_SIZE = 500
+
+CSV_COLUMNS = [
+    'id', 'title', 'description', 'type', 'created_at', 'author_id',
+    'author_username', 'course_id', 'approvers', 'content',
+]
+
+
+class ExportFormat(str, enum.Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+    @property
+    def media_type(self) -> str:
+        return {"ndjson": "application/x-ndjson", "csv": "text/csv"}[self.value]
+
+
+def _ndjson_lines(posts: list[dict[str, Any]]) -> bytes:
+    # Encoded as the post list is, so timestamps are in the same ISO 8601 form
+    return b"".join(orjson.dumps(post) + b"\n" for post in posts)
+
+
+def _csv_rows(posts: list[dict[str, Any]], header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS)
+    if header:
+        writer.writeheader()
+    for post in posts:
+        writer.writerow({
+            **post,
+            'created_at': post['created_at'].isoformat(),
+            'approvers': json.dumps(post['approvers']),
+        })
+    return buffer.getvalue()
+
+
+async def stream_course_posts(
+        engine: AsyncEngine,
+        course_id: int,
+        export_format: ExportFormat
+        ) -> AsyncGenerator[bytes, None]:
+    """Yield the course's posts, oldest first, in batches of `EXPORT_BATCH_SIZE` rows.
+
+    The posts are read through a server-side cursor on a session of their own, since the
+    response is still being streamed after the request's session has closed.
+    """
+    if export_format == ExportFormat.csv:
+        # Send the header straight away, before the first rows are read
+        yield _csv_rows([], header=True).encode()
+
+    query = (
+        course_posts_query(course_id)
+        .order_by(Post.created_at, Post.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async with AsyncSession(engine) as session:
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            posts = [post_row(row) for row in rows]
+            if export_format == ExportFormat.csv:
+                yield _csv_rows(posts).encode()
+            else:
+                yield _ndjson_lines(posts)
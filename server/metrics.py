@@ -0,0 +1,218 @@
+"""
+server/metrics.py
+
+Request and database metrics, and their exposition in the Prometheus text format.
+
+Everything is recorded in plain dicts by code running on the event loop, so recording a
+request costs a few dict updates, and the metrics only say anything about the worker
+process which serves the scrape.
+"""
+
+import bisect
+import contextvars
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy import Engine, event
+
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Media type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Keys of the caches' and pools' `stats()` which only ever increase
+COUNTER_STATS = frozenset({'hits', 'misses', 'executed', 'coalesced', 'published', 'dropped'})
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, plus one for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        total = 0
+        counts = []
+        for bound, count in zip((*map(repr, self.buckets), "+Inf"), self.counts):
+            total += count
+            counts.append((bound, total))
+        return counts
+
+
+class RequestStats:
+    """Database use by the request being served, see `current_request`"""
+    __slots__ = ('queries', 'query_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+# Set by the middleware for each request. Tasks started by a request, such as a coalesced
+# post list query, copy the context they were started in, so their queries count towards it.
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request", default=None)
+
+
+class RequestMetrics:
+    """Totals of the requests served by each route, labelled by method and route template
+    rather than by path, so that the number of series stays bounded."""
+
+    def __init__(self):
+        self.requests: dict[tuple[str, str, int], int] = {}
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.db_queries: dict[tuple[str, str], int] = {}
+        self.db_query_seconds: dict[tuple[str, str], float] = {}
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        key = (method, route)
+        self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+        histogram.observe(seconds)
+        self.db_queries[key] = self.db_queries.get(key, 0) + stats.queries
+        self.db_query_seconds[key] = self.db_query_seconds.get(key, 0.0) + stats.query_seconds
+
+    def clear(self) -> None:
+        self.requests.clear()
+        self.latency.clear()
+        self.db_queries.clear()
+        self.db_query_seconds.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the route, status and latency of each HTTP request, and
+    the database queries made while serving it. A streamed response is timed until its
+    last chunk has been sent."""
+
+    def __init__(self, app, metrics: RequestMetrics = request_metrics):
+        self.app = app
+        self.metrics = metrics
+        self._route_paths: Optional[dict[Callable, str]] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            # The router records the endpoint it matched in the scope
+            route = self._route_path(scope.get("app"), scope.get("endpoint"))
+            self.metrics.record(scope["method"], route, status, time.perf_counter() - started, stats)
+
+    def _route_path(self, app, endpoint) -> str:
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            self._route_paths = {route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")}
+        return self._route_paths.get(endpoint, "unmatched")
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Count the queries run through an engine, and the time spent on them, towards the
+    request being served"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += time.perf_counter() - conn.info.pop("query_started")
+
+
+def pool_stats(engine: Engine) -> Optional[dict[str, int]]:
+    """Connections of an engine's pool, or `None` if the pool doesn't keep connections"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return None
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+    }
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def render_request_metrics(metrics: RequestMetrics) -> list[str]:
+    lines = [
+        "# HELP http_requests_total Requests served, by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), count in sorted(metrics.requests.items()):
+        lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+    lines += [
+        "# HELP http_request_duration_seconds Time taken to serve requests, by route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), histogram in sorted(metrics.latency.items()):
+        for bound, count in histogram.cumulative_counts():
+            lines.append(f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}")
+        lines.append(f"http_request_duration_seconds_sum{_labels(method=method, route=route)} {histogram.sum!r}")
+        lines.append(f"http_request_duration_seconds_count{_labels(method=method, route=route)} "
+                     f"{sum(histogram.counts)}")
+
+    lines += [
+        "# HELP db_queries_total Database queries made while serving requests, by route.",
+        "# TYPE db_queries_total counter",
+    ]
+    for (method, route), count in sorted(metrics.db_queries.items()):
+        lines.append(f"db_queries_total{_labels(method=method, route=route)} {count}")
+    lines += [
+        "# HELP db_query_duration_seconds_total Time spent on database queries while serving requests, by route.",
+        "# TYPE db_query_duration_seconds_total counter",
+    ]
+    for (method, route), seconds in sorted(metrics.db_query_seconds.items()):
+        lines.append(f"db_query_duration_seconds_total{_labels(method=method, route=route)} {seconds!r}")
+    return lines
+
+
+def render_stats(prefix: str, help_text: str, stats: Iterable[tuple[dict[str, Any], dict[str, int]]]) -> list[str]:
+    """Render `stats()` dicts as one metric per key, e.g. `token_cache_hits_total`. Each
+    dict is given with the labels telling it apart from the others under the same prefix."""
+    stats = list(stats)
+    lines = []
+    for key in stats[0][1] if stats else ():
+        counter = key in COUNTER_STATS
+        name = f"{prefix}_{key}_total" if counter else f"{prefix}_{key}"
+        lines += [f"# HELP {name} {help_text}: {key.replace('_', ' ')}.",
+                  f"# TYPE {name} {'counter' if counter else 'gauge'}"]
+        lines += [f"{name}{_labels(**labels) if labels else ''} {values[key]}" for labels, values in stats]
+    return lines
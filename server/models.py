@@ -10,9 +10,11 @@ from typing import Optional
 import datetime
 
 from pydantic import ConfigDict
-from sqlalchemy import Enum, UniqueConstraint
+from sqlalchemy import JSON, Column, Enum, Index, UniqueConstraint
 from sqlmodel import Field, Relationship, SQLModel
 
+from server.compression import CompressedText
+
 
 class UserRole(enum.Enum):
     user = 0
@@ -34,7 +36,8 @@ class User(SQLModel, table=True):
 
 class Course(SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)
-    title: str
+    # Course titles are used as URL slugs, so every course-scoped request looks one up
+    title: str = Field(index=True, unique=True)
     description: str
     author_id: int = Field(foreign_key="user.id")
     created_at: Optional[datetime.datetime] = Field(default_factory=datetime.datetime.now)
@@ -43,6 +46,37 @@ class Course(SQLModel, table=True):
     posts: list["Post"] = Relationship(back_populates="course")
 
 
+class ChangeVersion(SQLModel, table=True):
+    """How many times the data in a scope has been written to, see `server.versions`"""
+    scope: str = Field(primary_key=True)
+    version: int = Field(default=0)
+
+
+class Change(SQLModel, table=True):
+    """An entry in the change log, see `server.changes`. Entries outlive the courses and
+    posts they refer to, so they hold their ids rather than foreign keys."""
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    type: str
+    course_id: int
+    course_title: str
+    post_id: Optional[int] = None
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.now, index=True)
+
+    # Sequence numbers of trimmed entries are never reused, so a client's cursor stays valid
+    __table_args__ = {'sqlite_autoincrement': True}
+
+
+class ChangeFeed(SQLModel, table=False):
+    changes: list[Change]
+    # Sequence number to pass as `since` to fetch the changes which follow these
+    next: int
+    # Whether more changes are already waiting to be fetched
+    more: bool
+    # The changes since the client's cursor have been trimmed from the log, so it must
+    # download every course again, then continue from `next`
+    reset: bool = False
+
+
 """
 ### Inheritance of Note and FlashcardSet from Post ###
 
@@ -64,7 +98,8 @@ class BasePost(SQLModel, table=False):
     type: str = Field(sa_column_kwargs={"nullable": False})
 
     created_at: Optional[datetime.datetime] = Field(default_factory=datetime.datetime.now)
-    author_id: int = Field(foreign_key="user.id")
+    author_id: int = Field(foreign_key="user.id", index=True)
+    # Indexed together with the post list's sort key in `Post.__table_args__`
     course_id: int = Field(foreign_key="course.id")
 
 
@@ -78,28 +113,103 @@ class Post(BasePost, table=True):
         table: This model will be stored persistently in the database.
     """
 
-    # field specific to notes
-    content: Optional[str] = Field(sa_column_kwargs={"nullable": True})
+    # field specific to notes. Large content is stored compressed, see `server.compression`.
+    content: Optional[str] = Field(default=None, sa_column=Column(CompressedText, nullable=True))
+
+    # Denormalized from the post's approvals, so the post list needs no approval joins.
+    # Kept up to date by `server.approvals.refresh_approval_summary`.
+    approval_count: int = Field(default=0, exclude=True, sa_column_kwargs={"server_default": "0"})
+    approver_usernames: list[str] = Field(
+        default_factory=list,
+        exclude=True,
+        sa_column=Column(JSON, nullable=False, server_default="[]")
+    )
 
     author: Optional[User] = Relationship(back_populates="posts")
     course: Optional[Course] = Relationship(back_populates="posts")
     approvals: list["Approval"] = Relationship(back_populates="post")
 
+    # Serves both lookups by course and the `(created_at, id)` keyset order of a course's posts
+    __table_args__ = (
+        Index("ix_post_course_id_created_at", "course_id", "created_at", "id"),
+    )
+
 
 class PostWithAuthor(BasePost, table=False):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     id: int
-    content: str
+    content: Optional[str] = None
     author_username: str
     approvers: list[str]
 
 
+class PostSummary(BasePost, table=False):
+    """A post in a course's post list, without its full content. The content is fetched
+    separately, one post at a time."""
+    id: int
+    content_preview: Optional[str] = None
+    content_length: int
+    author_username: str
+    approvers: list[str]
+
+
+class PostCreate(SQLModel, table=False):
+    """Fields of a new post which are supplied by its author"""
+    title: str
+    description: str
+    type: str
+    content: Optional[str] = None
+
+
+class BulkPostResult(SQLModel, table=False):
+    # Position of the post in the request
+    index: int
+    created: bool
+    id: Optional[int] = None
+    errors: list[str] = []
+
+
+class BulkPostsResponse(SQLModel, table=False):
+    created: int
+    failed: int
+    elapsed_ms: float
+    posts_per_second: float
+    results: list[BulkPostResult]
+
+
+class ApprovalChanges(SQLModel, table=False):
+    approve: list[int] = []
+    unapprove: list[int] = []
+
+
+class ApprovalChangesResult(SQLModel, table=False):
+    # Posts which weren't already approved by the user
+    approved: list[int]
+    # Posts which had been approved by the user
+    unapproved: list[int]
+    # Requested posts which aren't in the course
+    not_found: list[int]
+
+
+class SearchResult(SQLModel, table=False):
+    id: int
+    title: str
+    description: str
+    course_id: int
+    course_title: str
+    # Excerpt of the best matching column, with matches wrapped in `**`
+    snippet: str
+    # BM25 score; lower is a better match
+    rank: float
+
+
 class Approval(SQLModel, table=True):
     id: Optional[int] = Field(primary_key=True)
     created_at: Optional[datetime.datetime] = Field(default_factory=datetime.datetime.now)
 
+    # post_id is the leading column of the unique constraint below, which indexes it
     post_id: int = Field(foreign_key="post.id")
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
 
     post: Optional[Post] = Relationship(back_populates="approvals")
     user: Optional[User] = Relationship(back_populates="approvals")
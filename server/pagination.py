@@ -0,0 +1,77 @@
+"""
+server/pagination.py
+
+Encode and decode the opaque cursors used for keyset pagination.
+"""
+
+import base64
+import datetime
+import enum
+import json
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+# Range of SQLite's INTEGER, beyond which an id can't be bound as a query parameter
+MIN_ROW_ID = -2 ** 63
+MAX_ROW_ID = 2 ** 63 - 1
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class SortOrder(str, enum.Enum):
+    oldest = "oldest"
+    newest = "newest"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Cursor(BaseModel):
+    """Position of a row in a `(created_at, id)` ordered listing"""
+    created_at: datetime.datetime
+    id: int = Field(ge=MIN_ROW_ID, le=MAX_ROW_ID)
+
+    def encode(self) -> str:
+        raw = json.dumps([self.created_at.isoformat(), self.id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token: Optional[str]) -> Optional["Cursor"]:
+        if token is None:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return cls(created_at=datetime.datetime.fromisoformat(created_at), id=row_id)
+        # pydantic's ValidationError, e.g. for an id out of range, is a ValueError
+        except (ValueError, TypeError):
+            raise InvalidCursor(token)
+
+
+def page_cursor_headers(
+        rows: list[dict],
+        has_more: bool,
+        after: Optional[Cursor],
+        before: Optional[Cursor]
+        ) -> dict[str, str]:
+    """The `X-Next-Cursor` and `X-Prev-Cursor` headers of a page of rows, each of which has
+    a `created_at` and `id`. A cursor is only sent if there are rows in its direction."""
+    if not rows:
+        return {}
+    first = Cursor(created_at=rows[0]['created_at'], id=rows[0]['id']).encode()
+    last = Cursor(created_at=rows[-1]['created_at'], id=rows[-1]['id']).encode()
+    headers = {}
+    if before:
+        headers["X-Next-Cursor"] = last
+        if has_more:
+            headers["X-Prev-Cursor"] = first
+    else:
+        if has_more:
+            headers["X-Next-Cursor"] = last
+        if after:
+            headers["X-Prev-Cursor"] = first
+    return headers
@@ -0,0 +1,66 @@
+"""
+server/passwords.py
+
+Hash and verify user passwords, off the event loop.
+
+Hashing a password is deliberately slow, so it's run in a small pool of threads rather
+than in the request handler, where it would stop every other request being served.
+PBKDF2 spends its time in OpenSSL with the GIL released, so the threads run in parallel
+with the event loop.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+
+# Passwords stored before hashing was introduced are in plaintext. They are still accepted,
+# and are replaced by a hash the next time their user logs in.
+password_context = CryptContext(schemes=["pbkdf2_sha256", "plaintext"], deprecated=["plaintext"])
+
+# Threads hashing passwords. Logins beyond this many at once wait for a free thread.
+PASSWORD_HASH_WORKERS = min(4, os.cpu_count() or 1)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+# Hashes running or waiting for a thread
+_in_flight = 0
+
+# Verified against when a user doesn't exist, so a login takes as long either way
+_UNKNOWN_USER_HASH = password_context.hash("unknown user")
+
+
+async def _run(function, *args):
+    global _in_flight
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+    finally:
+        _in_flight -= 1
+
+
+def stats() -> dict[str, int]:
+    return {'workers': PASSWORD_HASH_WORKERS, 'in_flight': _in_flight}
+
+
+async def hash_password(password: str) -> str:
+    return await _run(password_context.hash, password)
+
+
+async def verify_password(password: str, stored: Optional[str]) -> tuple[bool, Optional[str]]:
+    """Check a password against a user's stored password, or against nothing if the user
+    doesn't exist.
+
+    Returns whether it matches, and a new hash to store in place of the old one if it
+    matches but was stored in plaintext or with outdated settings.
+    """
+    if stored is None:
+        await _run(password_context.verify, password, _UNKNOWN_USER_HASH)
+        return False, None
+    try:
+        return await _run(password_context.verify_and_update, password, stored)
+    except ValueError:
+        # A plaintext password which happens to look like a malformed hash
+        return False, None
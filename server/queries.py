@@ -0,0 +1,246 @@
+"""
+server/queries.py
+
+Read queries for the hot API paths. These select plain columns and build response
+rows directly, rather than loading ORM objects.
+"""
+
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import case, func, tuple_
+from sqlmodel import Session, select
+from sqlmodel import SQLModel
+from sqlmodel.sql.expression import Select
+
+from server.compression import summarize_content
+from server.models import Course, Post, User
+from server.pagination import Cursor, SortOrder
+
+
+COURSE_COLUMNS = (Course.id, Course.title, Course.description, Course.author_id, Course.created_at)
+
+# Columns needed to build a `PostWithAuthor`, in the order they are selected
+POST_LIST_COLUMNS = (
+    Post.id,
+    Post.title,
+    Post.description,
+    Post.type,
+    Post.created_at,
+    Post.author_id,
+    Post.course_id,
+    Post.content,
+    Post.approver_usernames,
+)
+
+# Characters of content included in a post's summary
+CONTENT_PREVIEW_LENGTH = 200
+# Bytes of compressed content read for a summary: enough for a deflate block header, plus the
+# compressed form of the preview, even where the content doesn't compress at all
+COMPRESSED_PREVIEW_BYTES = 512 + 8 * CONTENT_PREVIEW_LENGTH
+
+# Columns needed to build a `PostSummary`. Only the start of the stored content is read,
+# and compressed content is left for `summarize_content` to decompress the start of.
+CONTENT_PREFIX = case(
+    (func.typeof(Post.content) == 'blob', func.substr(Post.content, 1, COMPRESSED_PREVIEW_BYTES)),
+    else_=func.substr(Post.content, 1, CONTENT_PREVIEW_LENGTH)
+)
+POST_SUMMARY_COLUMNS = (
+    *POST_LIST_COLUMNS[:POST_LIST_COLUMNS.index(Post.content)],
+    CONTENT_PREFIX,
+    func.length(Post.content),
+    Post.approver_usernames,
+)
+
+# Column of each post field which can be selected on its own. The summary's content fields
+# are both built from `CONTENT_PREFIX` and the stored length, see `sparse_posts_query`.
+POST_FIELD_COLUMNS = {
+    'id': Post.id,
+    'title': Post.title,
+    'description': Post.description,
+    'type': Post.type,
+    'created_at': Post.created_at,
+    'author_id': Post.author_id,
+    'course_id': Post.course_id,
+    'content': Post.content,
+    'author_username': User.username,
+    'approvers': Post.approver_usernames,
+}
+SUMMARY_CONTENT_FIELDS = ('content_preview', 'content_length')
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def parse_fields(fields: Optional[str], model: type[SQLModel]) -> Optional[tuple[str, ...]]:
+    """Parse a comma separated `fields` parameter into the named fields of `model`, in the
+    order the model declares them, so that equivalent lists are equal. `None` means every field."""
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",")} - {""}
+    unknown = requested - model.model_fields.keys()
+    if not requested or unknown:
+        raise InvalidFields(", ".join(sorted(unknown)) or "no fields were given")
+    return tuple(name for name in model.model_fields if name in requested)
+
+
+def narrow_rows(rows: Iterable[dict[str, Any]], fields: tuple[str, ...]) -> list[dict[str, Any]]:
+    return [{name: row[name] for name in fields} for row in rows]
+
+
+def course_posts_query(course_id: int, summary: bool = False) -> Select:
+    """Select the `PostWithAuthor` columns of a course's posts, as read by `post_row`.
+    With `summary`, select the `PostSummary` columns instead, as read by `post_summary_row`."""
+    columns = POST_SUMMARY_COLUMNS if summary else POST_LIST_COLUMNS
+    return (
+        select(*columns, User.username)
+        .join(User, User.id == Post.author_id)
+        .where(Post.course_id == course_id)
+    )
+
+
+def sparse_posts_query(course_id: int, fields: Iterable[str], summary: bool = False) -> Select:
+    """Select only the columns needed for the given fields of a course's posts, as read by
+    `sparse_post_row`. The `id` and `created_at` of each post are always selected, since a
+    page's cursors are built from them. The author is only joined if their name is needed."""
+    names = dict.fromkeys(('id', 'created_at', *fields))
+    columns = [POST_FIELD_COLUMNS[name].label(name) for name in names if name not in SUMMARY_CONTENT_FIELDS]
+    if summary and not names.keys().isdisjoint(SUMMARY_CONTENT_FIELDS):
+        columns += [CONTENT_PREFIX.label('content_prefix'), func.length(Post.content).label('stored_length')]
+    query = select(*columns).where(Post.course_id == course_id)
+    if 'author_username' in names:
+        query = query.join(User, User.id == Post.author_id)
+    return query
+
+
+def sparse_post_row(row) -> dict[str, Any]:
+    """Build a dict of the fields selected by `sparse_posts_query`"""
+    post = row._asdict()
+    if 'content_prefix' in post:
+        post['content_preview'], post['content_length'] = summarize_content(
+            post.pop('content_prefix'), post.pop('stored_length'), CONTENT_PREVIEW_LENGTH)
+    return post
+
+
+def post_row(row) -> dict[str, Any]:
+    """Build a `PostWithAuthor` shaped dict from a row selected by `course_posts_query`"""
+    (post_id, title, description, post_type, created_at,
+     author_id, course_id, content, approvers, author_username) = row
+    return {
+        'id': post_id,
+        'title': title,
+        'description': description,
+        'type': post_type,
+        'created_at': created_at,
+        'author_id': author_id,
+        'course_id': course_id,
+        'content': content,
+        'author_username': author_username,
+        'approvers': approvers,
+    }
+
+
+def post_summary_row(row) -> dict[str, Any]:
+    """Build a `PostSummary` shaped dict from a row selected by `course_posts_query`"""
+    (post_id, title, description, post_type, created_at, author_id, course_id,
+     content_prefix, stored_length, approvers, author_username) = row
+    content_preview, content_length = summarize_content(content_prefix, stored_length, CONTENT_PREVIEW_LENGTH)
+    return {
+        'id': post_id,
+        'title': title,
+        'description': description,
+        'type': post_type,
+        'created_at': created_at,
+        'author_id': author_id,
+        'course_id': course_id,
+        'content_preview': content_preview,
+        'content_length': content_length,
+        'author_username': author_username,
+        'approvers': approvers,
+    }
+
+
+def get_post_summary(session: Session, post_id: int) -> Optional[dict[str, Any]]:
+    """Select one post as a `PostSummary` shaped dict"""
+    post = session.get(Post, post_id)
+    if post is None:
+        return None
+    row = session.exec(course_posts_query(post.course_id, summary=True).where(Post.id == post_id)).first()
+    return post_summary_row(row) if row else None
+
+
+def get_course_post_page(
+        session: Session,
+        course_id: int,
+        limit: int,
+        after: Optional[Cursor] = None,
+        before: Optional[Cursor] = None,
+        order: SortOrder = SortOrder.oldest,
+        summary: bool = False,
+        fields: Optional[Iterable[str]] = None
+        ) -> tuple[list[dict[str, Any]], bool]:
+    """Select one page of a course's posts as `PostWithAuthor` shaped dicts, or as
+    `PostSummary` shaped dicts with `summary`.
+
+    With `fields`, only those fields are selected, along with the `id` and `created_at`
+    of each post which the page's cursors are built from.
+
+    Returns the rows along with whether there are more rows beyond the page, in the
+    direction of travel.
+    """
+    # Paging backwards walks the index in the opposite direction, then flips the page back
+    descending = (order == SortOrder.newest) != (before is not None)
+    query = (
+        (course_posts_query(course_id, summary) if fields is None else sparse_posts_query(course_id, fields, summary))
+        .order_by(*((Post.created_at.desc(), Post.id.desc()) if descending else (Post.created_at, Post.id)))
+        .limit(limit + 1)
+    )
+    position = after or before
+    if position:
+        key = tuple_(Post.created_at, Post.id)
+        bound = tuple_(position.created_at, position.id)
+        query = query.where(key < bound if descending else key > bound)
+
+    rows = session.exec(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+
+    if fields is not None:
+        make_row = sparse_post_row
+    else:
+        make_row = post_summary_row if summary else post_row
+    return [make_row(row) for row in rows], has_more
+
+
+def get_course_rows(session: Session, fields: Iterable[str]) -> list[dict[str, Any]]:
+    """Select the given fields of every course, in the order of their ids like the full
+    course list. The order is explicit, since the query may be served from an index
+    ordered by some other column."""
+    columns = [getattr(Course, name) for name in fields]
+    return [row._asdict() for row in session.exec(select(*columns).order_by(Course.id))]
+
+
+def get_course_page(
+        session: Session,
+        course_id: int,
+        limit: int,
+        order: SortOrder = SortOrder.oldest,
+        summary: bool = False,
+        user_id: Optional[int] = None
+        ) -> Optional[tuple[dict[str, Any], Optional[dict[str, Any]], list[dict[str, Any]], bool]]:
+    """Select what a course's page shows when it's opened: the course, the first page of
+    its posts and, given a `user_id`, the user's display fields.
+
+    Returns the course, the user, and the page with whether there are more posts, or
+    `None` if the course doesn't exist.
+    """
+    course = session.exec(select(*COURSE_COLUMNS).where(Course.id == course_id)).first()
+    if course is None:
+        return None
+    user = None
+    if user_id is not None:
+        user = session.exec(select(User.username, User.email, User.role).where(User.id == user_id)).first()
+    posts, has_more = get_course_post_page(session, course_id, limit, order=order, summary=summary)
+    return course._asdict(), user._asdict() if user else None, posts, has_more
@@ -0,0 +1,215 @@
+"""
+server/search.py
+
+Full-text search over posts, backed by an SQLite FTS5 table.
+
+The `post_fts` table is contentless: it holds the index of each post's searchable text,
+keyed by the post's id, but not the text itself, so large content is only stored once,
+compressed, in the post table. It is kept in sync by the write paths that add or remove
+posts. Removing a post from the index takes the text it was indexed with, which is read
+back from the post table.
+
+Snippets can't be taken from a contentless table, so the posts on a page of results are
+indexed again in a private in-memory table, which `snippet()` highlights them from.
+"""
+
+import sqlite3
+from typing import Any, Iterable, Optional
+
+from sqlalchemy import DDL, event, func, text
+from sqlmodel import Session, SQLModel, select
+
+from server.models import Course, Post
+
+
+POST_FTS_TABLE = "post_fts"
+
+CREATE_POST_FTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {POST_FTS_TABLE} USING fts5("
+    "title, description, content, content='', tokenize='porter unicode61')"
+)
+
+# The table the posts on a page of results are highlighted from, see `highlight_posts`
+CREATE_SNIPPET_FTS = (
+    "CREATE VIRTUAL TABLE snippet_fts USING fts5("
+    "title, description, content, tokenize='porter unicode61')"
+)
+
+# Relative weight of a match in each column when ranking
+BM25_WEIGHTS = "10.0, 5.0, 1.0"
+
+SNIPPET_START = "**"
+SNIPPET_END = "**"
+SNIPPET_TOKENS = 16
+
+# Posts read at a time when rebuilding the index or removing posts from it
+INDEX_BATCH_SIZE = 500
+
+
+# Create the search table alongside the ORM tables, e.g. for the test database
+event.listen(SQLModel.metadata, "after_create", DDL(CREATE_POST_FTS).execute_if(dialect="sqlite"))
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text from a user into an FTS5 query matching posts containing every word.
+
+    Each word is quoted, so characters with special meaning to FTS5 are matched literally
+    rather than causing a syntax error.
+    """
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def index_post(session: Session, post: Post) -> None:
+    index_posts(session, [{
+        'id': post.id,
+        'title': post.title,
+        'description': post.description,
+        'content': post.content,
+    }])
+
+
+def index_posts(session: Session, posts: list[dict[str, Any]]) -> None:
+    """Add posts to the search index in one batch. Each post is a dict with the
+    `id`, `title`, `description` and `content` of the post."""
+    if not posts:
+        return
+    session.exec(
+        text(
+            f"INSERT INTO {POST_FTS_TABLE} (rowid, title, description, content) "
+            "VALUES (:id, :title, :description, :content)"
+        ),
+        params=posts
+    )
+
+
+def unindex_course(session: Session, course_id: int) -> None:
+    """Remove the posts of a course from the search index.
+
+    A contentless table only forgets a row when given the text it was indexed with, and
+    its index is corrupted by text it wasn't, so only posts which are in the index are
+    removed, with their content decompressed as it's read.
+    """
+    indexed = session.exec(
+        select(Post.id, Post.title, Post.description, Post.content)
+        .where(Post.course_id == course_id, Post.id.in_(text(f"SELECT rowid FROM {POST_FTS_TABLE}")))
+        .execution_options(yield_per=INDEX_BATCH_SIZE)
+    )
+    for rows in indexed.partitions():
+        session.exec(
+            text(
+                f"INSERT INTO {POST_FTS_TABLE} ({POST_FTS_TABLE}, rowid, title, description, content) "
+                "VALUES ('delete', :id, :title, :description, :content)"
+            ),
+            params=[row._asdict() for row in rows]
+        )
+
+
+def rebuild_index(session: Session) -> int:
+    """Repopulate the search table from the posts of every existing course.
+
+    Returns the number of posts indexed.
+    """
+    session.exec(text(f"INSERT INTO {POST_FTS_TABLE} ({POST_FTS_TABLE}) VALUES ('delete-all')"))
+    result = session.exec(text(
+        f"INSERT INTO {POST_FTS_TABLE} (rowid, title, description, content) "
+        "SELECT post.id, post.title, post.description, post.content "
+        "FROM post JOIN course ON course.id = post.course_id "
+        "WHERE typeof(post.content) != 'blob'"
+    ))
+    indexed = result.rowcount
+
+    # Compressed content is decompressed by the column type as it's read, a batch at a time
+    compressed = session.exec(
+        select(Post.id, Post.title, Post.description, Post.content)
+        .join(Course, Course.id == Post.course_id)
+        .where(func.typeof(Post.content) == 'blob')
+        .execution_options(yield_per=INDEX_BATCH_SIZE)
+    )
+    for rows in compressed.partitions():
+        index_posts(session, [row._asdict() for row in rows])
+        indexed += len(rows)
+
+    session.exec(text(f"INSERT INTO {POST_FTS_TABLE} ({POST_FTS_TABLE}) VALUES ('optimize')"))
+    return indexed
+
+
+def highlight_posts(match: str, posts: Iterable[tuple[int, str, str, Optional[str]]]) -> dict[int, str]:
+    """Return a snippet of each post matching the FTS5 query `match`, by post id. Each post is
+    a tuple of its id, title, description and content.
+
+    The posts are indexed with the same tokenizer as `post_fts`, so the snippets highlight
+    the same words the search matched.
+    """
+    connection = sqlite3.connect(":memory:")
+    try:
+        connection.execute(CREATE_SNIPPET_FTS)
+        connection.executemany(
+            "INSERT INTO snippet_fts (rowid, title, description, content) VALUES (?, ?, ?, ?)", posts)
+        return dict(connection.execute(
+            f"SELECT rowid, snippet(snippet_fts, -1, ?, ?, '...', {SNIPPET_TOKENS}) "
+            "FROM snippet_fts WHERE snippet_fts MATCH ?",
+            (SNIPPET_START, SNIPPET_END, match)
+        ))
+    finally:
+        connection.close()
+
+
+def search_posts(
+        session: Session,
+        query: str,
+        course_id: Optional[int] = None,
+        limit: int = 20,
+        offset: int = 0
+        ) -> list[dict[str, Any]]:
+    """Return the posts matching `query`, best match first, as `SearchResult` shaped dicts"""
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    course_filter = "AND post.course_id = :course_id" if course_id is not None else ""
+    ranked = session.exec(
+        text(
+            f"SELECT post.id, bm25({POST_FTS_TABLE}, {BM25_WEIGHTS}) AS rank "
+            f"FROM {POST_FTS_TABLE} "
+            f"JOIN post ON post.id = {POST_FTS_TABLE}.rowid "
+            "JOIN course ON course.id = post.course_id "
+            f"WHERE {POST_FTS_TABLE} MATCH :match {course_filter} "
+            "ORDER BY rank, post.id "
+            "LIMIT :limit OFFSET :offset"
+        ),
+        params={
+            'match': match,
+            'course_id': course_id,
+            'limit': limit,
+            'offset': offset,
+        }
+    ).all()
+    if not ranked:
+        return []
+
+    # Only the posts on this page are read in full, with their content decompressed
+    posts = {
+        row.id: row for row in session.exec(
+            select(
+                Post.id, Post.title, Post.description, Post.content, Post.course_id,
+                Course.title.label('course_title')
+            )
+            .join(Course, Course.id == Post.course_id)
+            .where(Post.id.in_([post_id for post_id, _ in ranked]))
+        )
+    }
+    snippets = highlight_posts(match, (
+        (post.id, post.title, post.description, post.content) for post in posts.values()))
+    return [
+        {
+            'id': post_id,
+            'title': posts[post_id].title,
+            'description': posts[post_id].description,
+            'course_id': posts[post_id].course_id,
+            'course_title': posts[post_id].course_title,
+            'snippet': snippets.get(post_id, ""),
+            'rank': rank,
+        }
+        for post_id, rank in ranked
+    ]
@@ -4,8 +4,10 @@ server/session_security.py
 Handle creation and decoding of session tokens.
 """
 
+import hashlib
 import time
-from typing import Optional, Union
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Union
 
 from pydantic import BaseModel
 from jose import JWTError, jwt
@@ -20,11 +22,123 @@ from server.models import UserRole
 # Secret key for JWT
 SECRET_KEY = "secret_key"
 ALGORITHM = "HS256"
+# Seconds a session token is valid for
+TOKEN_LIFETIME = 600
+# Version of the user's display fields carried in session tokens. Tokens with any other
+# version, including those issued before the fields were added, carry no usable fields.
+# Increase it whenever the fields change.
+CLAIMS_VERSION = 1
 
 
 class TokenData(BaseModel):
     user_id: int
     role: UserRole
+    # The user's display fields, as of when the token was issued. See `CLAIMS_VERSION`.
+    username: Optional[str] = None
+    email: Optional[str] = None
+    claims_version: int = 0
+
+    @property
+    def has_current_claims(self) -> bool:
+        return self.claims_version == CLAIMS_VERSION
+
+
+class VerifiedToken(NamedTuple):
+    token_data: TokenData
+    issued_at: float
+    expires_at: float
+
+
+class TokenCache:
+    """Bounded LRU cache of session tokens whose signature and claims have been verified,
+    keyed by a digest of the token, so repeat requests with the same token skip both.
+
+    Each entry expires at the token's `exp`. Revoking a token, or every token of a user,
+    evicts the entries and stops the tokens from being verified again until they expire.
+    Revocations are only known to the process they were made in.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._tokens: OrderedDict[bytes, VerifiedToken] = OrderedDict()
+        # Digests of revoked tokens, and when each token expires
+        self._revoked_tokens: dict[bytes, float] = {}
+        # Users whose tokens issued up to the given time are revoked
+        self._revoked_users: dict[int, float] = {}
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[TokenData]:
+        key = self.digest(token)
+        entry = self._tokens.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.time():
+            del self._tokens[key]
+            self.misses += 1
+            return None
+        self._tokens.move_to_end(key)
+        self.hits += 1
+        return entry.token_data
+
+    def put(self, token: str, verified: VerifiedToken) -> bool:
+        """Cache a verified token, unless it has been revoked. Returns whether it's valid."""
+        key = self.digest(token)
+        if key in self._revoked_tokens:
+            return False
+        revoked_at = self._revoked_users.get(verified.token_data.user_id)
+        if revoked_at is not None and verified.issued_at <= revoked_at:
+            return False
+        self._tokens[key] = verified
+        if len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+        return True
+
+    def revoke(self, token: str, expires_at: float) -> None:
+        self._prune()
+        key = self.digest(token)
+        self._tokens.pop(key, None)
+        self._revoked_tokens[key] = expires_at
+
+    def revoke_user(self, user_id: int) -> None:
+        """Revoke every token issued to a user so far"""
+        self._prune()
+        for key in [key for key, entry in self._tokens.items() if entry.token_data.user_id == user_id]:
+            del self._tokens[key]
+        self._revoked_users[user_id] = time.time()
+
+    def _prune(self) -> None:
+        """Forget revocations of tokens which have since expired"""
+        now = time.time()
+        self._revoked_tokens = {key: exp for key, exp in self._revoked_tokens.items() if exp > now}
+        self._revoked_users = {
+            user_id: revoked_at for user_id, revoked_at in self._revoked_users.items()
+            if revoked_at + TOKEN_LIFETIME > now
+        }
+
+    def clear(self) -> None:
+        self._tokens.clear()
+        self._revoked_tokens.clear()
+        self._revoked_users.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self._tokens),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'revoked': len(self._revoked_tokens) + len(self._revoked_users),
+        }
+
+
+token_cache = TokenCache()
 
 
 class OAuth2PasswordBearerWithCookie(OAuth2):
@@ -61,24 +175,56 @@ class OAuth2PasswordBearerWithCookie(OAuth2):
 class UserSessionManager:
 
     @staticmethod
-    def sign_jwt(user_id: int, role: UserRole) -> dict[str, any]:
-        """Sign a JWT token with the username"""
+    def sign_jwt(
+            user_id: int,
+            role: UserRole,
+            username: Optional[str] = None,
+            email: Optional[str] = None
+            ) -> dict[str, any]:
+        """Sign a JWT token with the user's id and role.
+
+        Given the user's username and email, they are included in the token too, so the
+        client's login status can be answered without looking the user up.
+        """
         payload = {
             'sub': str(user_id),
-            'exp': time.time() + 600,
+            'exp': time.time() + TOKEN_LIFETIME,
             'iat': time.time(),
             'role': str(role.value)
         }
+        if username is not None:
+            payload.update({'username': username, 'email': email, 'cv': CLAIMS_VERSION})
         return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
     @staticmethod
     def decode_jwt(token: str) -> Union[TokenData, None]:
+        token_data = token_cache.get(token)
+        if token_data is not None:
+            return token_data
         try:
             decoded_token = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
             if decoded_token['exp'] < time.time():
                 return None
             else:
-                return TokenData(user_id=decoded_token['sub'], role=UserRole(int(decoded_token['role'])))
+                token_data = TokenData(
+                    user_id=decoded_token['sub'],
+                    role=UserRole(int(decoded_token['role'])),
+                    username=decoded_token.get('username'),
+                    email=decoded_token.get('email'),
+                    claims_version=decoded_token.get('cv', 0)
+                )
         except JWTError:
             return None
+        verified = VerifiedToken(token_data, decoded_token['iat'], decoded_token['exp'])
+        return token_data if token_cache.put(token, verified) else None
+
+    @staticmethod
+    def revoke_jwt(token: str) -> None:
+        """Stop a token from being accepted, e.g. when its user logs out"""
+        try:
+            claims = jwt.get_unverified_claims(token)
+            expires_at = float(claims['exp'])
+        except (JWTError, KeyError, TypeError, ValueError):
+            return
+        token_cache.revoke(token, expires_at)
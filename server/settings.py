@@ -0,0 +1,76 @@
+"""
+server/settings.py
+
+Server configuration, read from environment variables.
+"""
+
+import enum
+import os
+from typing import Optional
+
+from pydantic import BaseModel
+from sqlalchemy.engine import make_url
+
+
+class SQLiteProfile(str, enum.Enum):
+    # SQLite's own defaults: rollback journal, and writers block readers
+    default = "default"
+    # Write-ahead log and relaxed syncing, so readers and a writer can run concurrently
+    tuned = "tuned"
+
+
+class DatabaseSettings(BaseModel):
+    url: str = "sqlite:///db.sqlite3"
+    # Derived from `url` when not given, by swapping in the async driver
+    async_url: Optional[str] = None
+    # Database serving read-only requests, e.g. a replica. Reads use the primary when not given.
+    read_url: Optional[str] = None
+    read_async_url: Optional[str] = None
+    # Serve reads through a separate pool of read-only connections to the primary SQLite file
+    sqlite_read_only_pool: bool = False
+
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30
+    pool_pre_ping: bool = False
+
+    sqlite_profile: SQLiteProfile = SQLiteProfile.tuned
+    sqlite_busy_timeout_ms: int = 5000
+    # Negative values are in KiB, as with SQLite's `cache_size` pragma
+    sqlite_cache_size: int = -64 * 1024
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.url.startswith("sqlite")
+
+    def get_async_url(self) -> str:
+        if self.async_url:
+            return self.async_url
+        if self.url.startswith("sqlite://"):
+            return "sqlite+aiosqlite://" + self.url[len("sqlite://"):]
+        raise ValueError(f"DATABASE_ASYNC_URL must be set for {self.url}")
+
+    @property
+    def is_read_only(self) -> bool:
+        return self.is_sqlite and make_url(self.url).query.get("mode") == "ro"
+
+    def get_read_settings(self) -> Optional["DatabaseSettings"]:
+        """Settings for the database serving reads, or `None` if reads should use the primary"""
+        if self.read_url:
+            return self.model_copy(update={'url': self.read_url, 'async_url': self.read_async_url})
+        if self.is_sqlite and self.sqlite_read_only_pool:
+            path = make_url(self.url).database
+            read_url = f"sqlite:///file:{path}?mode=ro&uri=true"
+            return self.model_copy(update={'url': read_url, 'async_url': None})
+        return None
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        """Read settings from `DATABASE_*` environment variables, e.g. `DATABASE_POOL_SIZE`"""
+        values = {}
+        for name in cls.model_fields:
+            value = os.environ.get(f"DATABASE_{name.upper()}")
+            if value is not None:
+                values[name] = value
+        return cls(**values)
@@ -0,0 +1,55 @@
+"""
+server/singleflight.py
+
+Coalescing of identical concurrent reads, so that a burst of the same request runs
+its query once.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time. Callers with the same key as a call in
+    flight wait for its result rather than starting their own.
+
+    The call runs in a task of its own, so a caller giving up (e.g. its client
+    disconnecting) doesn't cancel it for the others. The call therefore mustn't use
+    anything owned by a single caller, such as the session of its request. A failed
+    call raises its exception in every caller waiting on it.
+    """
+
+    def __init__(self):
+        # Calls started, and calls which waited on one already in flight
+        self.executed = 0
+        self.coalesced = 0
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def clear(self) -> None:
+        self.executed = 0
+        self.coalesced = 0
+
+    def stats(self) -> dict[str, int]:
+        return {'in_flight': len(self._calls), 'executed': self.executed, 'coalesced': self.coalesced}
+
+
+# Reads of a course's post list, keyed by the ETag of the response
+course_post_flights = SingleFlight()
@@ -0,0 +1,86 @@
+"""
+server/versions.py
+
+Change versions, from which the ETags of the read endpoints are derived.
+
+Every write bumps the global version, and a write to a course or its posts also bumps
+the version of that course. The versions are kept in the database, so that every worker
+process agrees on them, and are bumped within the transaction of the write itself.
+"""
+
+import hashlib
+from typing import Iterable, Optional
+
+from sqlalchemy import String, cast, literal, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from server.models import ChangeVersion, Post
+
+
+GLOBAL_SCOPE = "global"
+
+
+def course_scope(course_id: int) -> str:
+    return f"course:{course_id}"
+
+
+def _bump(statement):
+    """Make an insert of scopes at version 1 add one to the version of those that exist"""
+    return statement.on_conflict_do_update(
+        index_elements=[ChangeVersion.scope],
+        set_={'version': ChangeVersion.version + 1}
+    )
+
+
+def bump_versions(session: Session, course_ids: Iterable[int] = ()) -> None:
+    """Record a write to the given courses, or to data outside of any course if none are given"""
+    scopes = [GLOBAL_SCOPE, *(course_scope(course_id) for course_id in set(course_ids))]
+    session.exec(_bump(insert(ChangeVersion)), params=[{'scope': scope, 'version': 1} for scope in scopes])
+
+
+def bump_post_versions(session: Session, post_ids: Iterable[int]) -> None:
+    """Record a write to the given posts, bumping the versions of the courses they belong to"""
+    bump_versions(session)
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    scopes = (
+        select(literal("course:") + cast(Post.course_id, String), literal(1))
+        .where(Post.id.in_(post_ids))
+        .distinct()
+    )
+    session.exec(_bump(insert(ChangeVersion).from_select(['scope', 'version'], scopes)))
+
+
+def bump_all_versions(session: Session) -> None:
+    """Record a write which may have changed any course, e.g. a maintenance command"""
+    session.exec(update(ChangeVersion).values(version=ChangeVersion.version + 1))
+    bump_versions(session)
+
+
+def get_versions(session: Session, course_id: Optional[int] = None) -> tuple[int, int]:
+    """Return the global version, and the version of the course if one is given"""
+    scopes = [GLOBAL_SCOPE] if course_id is None else [GLOBAL_SCOPE, course_scope(course_id)]
+    versions = dict(session.exec(
+        select(ChangeVersion.scope, ChangeVersion.version).where(ChangeVersion.scope.in_(scopes))
+    ).all())
+    return versions.get(GLOBAL_SCOPE, 0), versions.get(course_scope(course_id), 0) if course_id else 0
+
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag from the versions and parameters that determine a response"""
+    digest = hashlib.blake2s(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an `If-None-Match` header lists `etag`, using the weak comparison it calls for"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
@@ -0,0 +1,108 @@
+"""
+tests/test_cache.py
+
+Unit tests for the in-process caches.
+"""
+
+import time
+
+from sqlmodel import Session
+
+from server.cache import CourseCache
+from server.models import Course, UserRole
+from server.session_security import TokenCache, TokenData, UserSessionManager, VerifiedToken, token_cache
+from utils import session_fixture  # noqa: F401
+
+
+def test_course_cache_hits_and_misses(session: Session):
+    session.add(Course(id=1, title="Cached Course", description="A course", author_id=1))
+    session.commit()
+    cache = CourseCache()
+
+    record = cache.get(session, "Cached Course")
+    assert record.id == 1
+    assert record.author_id == 1
+    assert cache.get(session, "Cached Course") == record
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Courses which don't exist are never cached
+    assert cache.get(session, "Missing Course") is None
+    assert cache.get(session, "Missing Course") is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_course_cache_eviction(session: Session):
+    session.add_all([
+        Course(id=i, title=f"Course {i}", description="A course", author_id=1)
+        for i in range(1, 4)
+    ])
+    session.commit()
+    cache = CourseCache(max_size=2)
+
+    cache.get(session, "Course 1")
+    cache.get(session, "Course 2")
+    cache.get(session, "Course 1")
+    # Course 2 is now the least recently used, so it is evicted
+    cache.get(session, "Course 3")
+    assert cache.stats()['size'] == 2
+
+    cache.get(session, "Course 1")
+    cache.get(session, "Course 2")
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+def test_course_cache_invalidation(session: Session):
+    session.add(Course(id=1, title="Renamed Course", description="A course", author_id=1))
+    session.commit()
+    cache = CourseCache()
+    cache.get(session, "Renamed Course")
+
+    course = session.get(Course, 1)
+    course.title = "New Title"
+    session.commit()
+    cache.invalidate("Renamed Course")
+
+    assert cache.get(session, "Renamed Course") is None
+    assert cache.get(session, "New Title").id == 1
+
+
+def test_token_cache_skips_verification(monkeypatch):
+    token_cache.clear()
+    token = UserSessionManager.sign_jwt(7, UserRole.teacher)
+    assert UserSessionManager.decode_jwt(token) == TokenData(user_id=7, role=UserRole.teacher)
+    assert (token_cache.hits, token_cache.misses) == (0, 1)
+
+    def no_verify(*args, **kwargs):
+        raise AssertionError("The token was verified again")
+    monkeypatch.setattr("server.session_security.jwt.decode", no_verify)
+    assert UserSessionManager.decode_jwt(token) == TokenData(user_id=7, role=UserRole.teacher)
+    assert (token_cache.hits, token_cache.misses) == (1, 1)
+    token_cache.clear()
+
+
+def test_token_cache_expiry_and_revocation():
+    cache = TokenCache(max_size=2)
+    now = time.time()
+    teacher = TokenData(user_id=1, role=UserRole.teacher)
+    user = TokenData(user_id=2, role=UserRole.user)
+
+    assert cache.put("expired", VerifiedToken(teacher, now - 10, now - 1))
+    assert cache.get("expired") is None
+    assert cache.stats()['size'] == 0
+
+    assert cache.put("first", VerifiedToken(teacher, now, now + 60))
+    assert cache.put("second", VerifiedToken(user, now, now + 60))
+    assert cache.put("third", VerifiedToken(user, now, now + 60))
+    # The least recently used token is evicted
+    assert cache.get("first") is None
+    assert cache.get("second") == user
+
+    cache.revoke("second", now + 60)
+    assert cache.get("second") is None
+    assert not cache.put("second", VerifiedToken(user, now, now + 60))
+
+    # Tokens issued to a user before their revocation are rejected, but later ones aren't
+    cache.revoke_user(2)
+    assert cache.get("third") is None
+    assert not cache.put("third", VerifiedToken(user, now, now + 60))
+    assert cache.put("fourth", VerifiedToken(user, time.time() + 1, now + 60))
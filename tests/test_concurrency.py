@@ -0,0 +1,255 @@
+"""
+tests/test_concurrency.py
+
+Tests ensuring that requests are served concurrently, rather than one at a time.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+
+import httpx
+import pytest
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import main
+from main import app
+from server.events import course_events
+from server.models import Post, User, UserRole
+from server.passwords import password_context
+from server.session_security import UserSessionManager
+from server.singleflight import SingleFlight, course_post_flights
+from utils import async_session_fixture  # noqa: F401
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture(name='client')
+async def client_fixture(async_session: AsyncSession):
+    teacher = User(username="teacher", password="password", role=UserRole.teacher)
+    async_session.add(teacher)
+    await async_session.commit()
+    session_token = UserSessionManager.sign_jwt(teacher.id, teacher.role)
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://localhost",
+        cookies={"access_token": f"Bearer {session_token}"}
+    ) as client:
+        yield client
+
+
+@pytest.mark.anyio
+async def test_requests_overlap_while_waiting_on_database(async_session: AsyncSession, client: httpx.AsyncClient):
+    """Ensure a request waiting on the database doesn't stop others from being served
+    """
+    # Another connection holds the write lock, so the next write has to wait for it
+    blocker = sqlite3.connect(async_session.bind.url.database, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        write = asyncio.create_task(
+            client.post("/courses/create", json={"title": "Blocked", "description": "Waits for the lock"})
+        )
+        await asyncio.sleep(0.2)
+        assert not write.done()
+
+        # While the write waits, the event loop carries on serving other requests
+        response = await asyncio.wait_for(client.get("/courses"), timeout=2)
+        assert response.status_code == 200
+        assert not write.done()
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+
+    response = await write
+    assert response.status_code == 200
+    assert response.json() == {"message": "Course created"}
+
+
+@pytest.mark.anyio
+async def test_concurrent_reads(client: httpx.AsyncClient):
+    """Ensure many reads in flight at once are all answered correctly"""
+    response = await client.post("/courses/create", json={"title": "Shared", "description": "Read by all"})
+    assert response.status_code == 200
+
+    responses = await asyncio.gather(*(client.get("/courses") for _ in range(20)))
+    assert all(response.status_code == 200 for response in responses)
+    assert all([course["title"] for course in response.json()] == ["Shared"] for response in responses)
+
+
+@pytest.mark.anyio
+async def test_identical_reads_are_coalesced(client: httpx.AsyncClient, monkeypatch):
+    """Ensure identical post list requests in flight at once share one query, while requests
+    for a different page run their own"""
+    response = await client.post("/courses/create", json={"title": "Lecture", "description": "Opened by all"})
+    assert response.status_code == 200
+    response = await client.post("/courses/Lecture/create", json={"title": "Slides", "description": "", "type": "note"})
+    assert response.status_code == 200
+
+    queries = 0
+    render = main.render_course_post_page
+
+    async def slow_render(*args):
+        nonlocal queries
+        queries += 1
+        # Hold the query open, so the other requests arrive while it's in flight
+        await asyncio.sleep(0.2)
+        return await render(*args)
+    monkeypatch.setattr(main, "render_course_post_page", slow_render)
+    before = course_post_flights.stats()
+
+    responses = await asyncio.gather(
+        *(client.get("/courses/Lecture/posts") for _ in range(20)),
+        client.get("/courses/Lecture/posts", params={"summary": True}),
+    )
+    assert all(response.status_code == 200 for response in responses)
+    assert all([post["title"] for post in response.json()] == ["Slides"] for response in responses)
+    assert len({response.headers["etag"] for response in responses[:20]}) == 1
+    assert queries == 2
+    after = course_post_flights.stats()
+    assert after['executed'] - before['executed'] == 2
+    assert after['coalesced'] - before['coalesced'] == 19
+    assert after['in_flight'] == 0
+
+
+@pytest.mark.anyio
+async def test_coalesced_failure_reaches_every_caller():
+    flights = SingleFlight()
+    started = asyncio.Event()
+
+    async def failing():
+        started.set()
+        await asyncio.sleep(0.05)
+        raise RuntimeError("query failed")
+
+    first = asyncio.create_task(flights.do("key", failing))
+    await started.wait()
+    second = asyncio.create_task(flights.do("key", failing))
+    for caller in (first, second):
+        with pytest.raises(RuntimeError):
+            await caller
+    assert flights.stats() == {'in_flight': 0, 'executed': 1, 'coalesced': 1}
+
+
+@pytest.mark.anyio
+async def test_login_burst_does_not_stall_reads(async_session: AsyncSession, client: httpx.AsyncClient, monkeypatch):
+    """Ensure requests are still served promptly while a burst of logins is hashing passwords"""
+    async_session.add(User(username="student", password=password_context.hash("password"), role=UserRole.user))
+    await async_session.commit()
+
+    # Stand in for an expensive hash, which holds its thread without holding the event loop
+    verify_and_update = password_context.verify_and_update
+
+    def slow_verify_and_update(*args, **kwargs):
+        time.sleep(0.2)
+        return verify_and_update(*args, **kwargs)
+    monkeypatch.setattr(password_context, "verify_and_update", slow_verify_and_update)
+
+    logins = [
+        asyncio.create_task(client.post("/login", json={"username": "student", "password": "password"}))
+        for _ in range(8)
+    ]
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    response = await client.get("/courses")
+    assert response.status_code == 200
+    assert time.perf_counter() - started < 0.15
+    assert not all(login.done() for login in logins)
+
+    responses = await asyncio.gather(*logins)
+    assert all(response.json()["logged_in"] for response in responses)
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for message in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@pytest.mark.anyio
+async def test_course_event_stream(client: httpx.AsyncClient):
+    """Ensure subscribers to a course's events hear about its new posts, approvals and
+    deletion, after which their stream ends"""
+    response = await client.post("/courses/create", json={"title": "Live", "description": "Watched by all"})
+    assert response.status_code == 200
+
+    stream = asyncio.create_task(client.get("/courses/Live/events"))
+    for _ in range(100):
+        if course_events.stats()['subscribers']:
+            break
+        await asyncio.sleep(0.01)
+    assert course_events.stats()['subscribers'] == 1
+
+    response = await client.post("/courses/Live/create", json={"title": "Notes", "description": "", "type": "note"})
+    assert response.status_code == 200
+    post_id = (await client.get("/courses/Live/posts")).json()[0]["id"]
+    assert (await client.post(f"/courses/Live/posts/{post_id}/approve")).status_code == 200
+    assert (await client.post(f"/courses/Live/posts/{post_id}/unapprove")).status_code == 200
+    # Deleting the course ends the stream
+    client.cookies["access_token"] = f"Bearer {UserSessionManager.sign_jwt(99, UserRole.admin)}"
+    response = await client.post("/courses/Live/delete")
+    assert response.status_code == 200
+
+    response = await asyncio.wait_for(stream, timeout=2)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    assert [event_type for event_type, _ in events] == [
+        "post-created", "post-approved", "post-unapproved", "course-deleted"
+    ]
+    assert events[0][1]["title"] == "Notes"
+    assert events[0][1]["author_username"] == "teacher"
+    assert events[1][1] == {"id": post_id, "course_id": events[0][1]["course_id"], "approvers": ["teacher"]}
+    assert events[2][1]["approvers"] == []
+    assert course_events.stats()['subscribers'] == 0
+
+
+@pytest.mark.anyio
+async def test_course_lookup_during_delete(async_session: AsyncSession, client: httpx.AsyncClient):
+    """Ensure a course looked up while it's being deleted isn't left in the cache, and
+    that posts can't be written to a course deleted behind the cache's back"""
+    for title in ("Doomed", "Deleted elsewhere"):
+        response = await client.post("/courses/create", json={"title": title, "description": ""})
+        assert response.status_code == 200
+        assert (await client.get(f"/courses/{title}/posts")).status_code == 200
+
+    # Another connection holds the write lock, so the delete waits before committing
+    blocker = sqlite3.connect(async_session.bind.url.database, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    client.cookies["access_token"] = f"Bearer {UserSessionManager.sign_jwt(99, UserRole.admin)}"
+    try:
+        delete = asyncio.create_task(client.post("/courses/Doomed/delete"))
+        await asyncio.sleep(0.2)
+        assert not delete.done()
+        # Caches the course again, while the delete is under way
+        assert (await client.get("/courses/Doomed/posts")).status_code == 200
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    assert (await delete).status_code == 200
+
+    assert (await client.get("/courses/Doomed/posts")).status_code == 404
+    response = await client.post("/courses/Doomed/create", json={"title": "Lost", "description": "", "type": "note"})
+    assert response.status_code == 404
+
+    # As if deleted by another worker process, whose deletion doesn't reach this cache
+    deleter = sqlite3.connect(async_session.bind.url.database)
+    with deleter:
+        deleter.execute("DELETE FROM course WHERE title = 'Deleted elsewhere'")
+    deleter.close()
+    post = {"title": "Lost", "description": "", "type": "note"}
+    for url, body in [
+        ("/courses/Deleted elsewhere/create", post),
+        ("/courses/Deleted elsewhere/posts/bulk", [post]),
+    ]:
+        response = await client.post(url, json=body)
+        assert response.status_code == 404
+    assert (await client.get("/courses/Deleted elsewhere/posts")).status_code == 404
+    assert (await async_session.exec(select(Post))).all() == []
@@ -4,11 +4,21 @@ test/test_endpoints.py
 Simple unit tests for database models.
 """
 
+import datetime
+
 import pytest
-from sqlalchemy.exc import IntegrityError
-from sqlmodel import Session
+from sqlalchemy import text, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlmodel import Session, SQLModel, select
 
+from server import compression
+from server.compression import compress_existing_content, stored_content_size
+from server.engine import make_async_engine, make_engine
+from server.settings import DatabaseSettings, SQLiteProfile
+from server.approvals import find_inconsistent_posts, refresh_approval_summary
 from server.models import User, UserRole, Course, Post, Approval
+from server.queries import CONTENT_PREVIEW_LENGTH, get_course_post_page, sparse_posts_query
+from server.search import rebuild_index, search_posts, unindex_course
 from utils import session_fixture  # noqa: F401
 
 
@@ -165,3 +175,246 @@ def test_unique_approval_constraint(session: Session):
     session.add(approval2)
     with pytest.raises(IntegrityError):
         session.commit()
+
+
+def query_plan(session: Session, statement) -> list[str]:
+    """Return the detail column of SQLite's `EXPLAIN QUERY PLAN` for a statement"""
+    compiled = statement.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={"render_postcompile": True}
+    )
+    # The values of the parameters don't affect the choice of plan
+    params = tuple(None for _ in compiled.positiontup)
+    rows = session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)
+    return [row[-1] for row in rows]
+
+
+@pytest.mark.parametrize("statement, index", [
+    (select(Course.id).where(Course.title == "Some Course"), "ix_course_title"),
+    (
+        select(Post.id)
+        .where(Post.course_id == 1, tuple_(Post.created_at, Post.id) > tuple_(datetime.datetime.now(), 1))
+        .order_by(Post.created_at, Post.id),
+        "ix_post_course_id_created_at"
+    ),
+    (select(Post.id).where(Post.author_id == 1), "ix_post_author_id"),
+    (select(Approval.user_id).where(Approval.post_id.in_([1, 2, 3])), "sqlite_autoindex_approval_1"),
+    (select(Approval.post_id).where(Approval.user_id == 1), "ix_approval_user_id"),
+])
+def test_lookups_use_indexes(session: Session, statement, index: str):
+    """Ensure lookups on hot columns are served by an index, rather than a full table scan
+    """
+    plan = query_plan(session, statement)
+    assert any(index in step for step in plan), plan
+    assert not any(step.startswith("SCAN") for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_course_title_uniqueness(session: Session):
+    """Test database constraint ensuring two courses cannot have the same title
+    """
+    session.add(Course(title="Duplicate", description="First", author_id=1))
+    session.add(Course(title="Duplicate", description="Second", author_id=1))
+    with pytest.raises(IntegrityError):
+        session.commit()
+
+
+def test_approval_summary_consistency(session: Session):
+    """Ensure the approval summary on posts can be checked against, and rebuilt from,
+    the approval table.
+    """
+    users = [
+        User(id=i, username=f"approver{i}", password="password", role=UserRole.teacher)
+        for i in (1, 2)
+    ]
+    course = Course(id=1, title="Course", description="A course", author_id=1)
+    posts = [
+        Post(id=i, title=f"Post {i}", description="A post", type="note", author_id=1, course_id=1)
+        for i in (1, 2, 3)
+    ]
+    session.add_all(users + [course] + posts)
+    session.commit()
+    assert find_inconsistent_posts(session) == []
+
+    session.add_all([
+        Approval(post_id=1, user_id=2),
+        Approval(post_id=1, user_id=1),
+        Approval(post_id=2, user_id=1),
+    ])
+    session.commit()
+    assert find_inconsistent_posts(session) == [1, 2]
+
+    refresh_approval_summary(session, [1])
+    session.commit()
+    assert find_inconsistent_posts(session) == [2]
+
+    refresh_approval_summary(session)
+    session.commit()
+    assert find_inconsistent_posts(session) == []
+    post = session.get(Post, 1)
+    session.refresh(post)
+    assert post.approval_count == 2
+    assert post.approver_usernames == ["approver2", "approver1"]
+
+
+def test_rebuild_search_index(session: Session):
+    """Ensure posts written without going through the API are found after the search
+    index is rebuilt, except those whose course no longer exists.
+    """
+    session.add(Course(id=1, title="Course", description="A course", author_id=1))
+    session.add_all([
+        Post(id=1, title="Recursion", description="A post", type="note", author_id=1, course_id=1),
+        Post(id=2, title="Recursion again", description="An orphan", type="note", author_id=1, course_id=2),
+    ])
+    session.commit()
+    assert search_posts(session, "recursion") == []
+
+    assert rebuild_index(session) == 1
+    assert [result["id"] for result in search_posts(session, "recursion")] == [1]
+
+
+def test_large_content_stored_compressed(session: Session):
+    """Ensure large content is compressed at rest, yet reads back unchanged, is summarized from
+    the start of its compressed form, and is found by search after the index is rebuilt,
+    without the index keeping a copy of it."""
+    long_content = "Recursion is when a function calls itself. " * 200 + "ünïcode"
+    session.add(Course(id=1, title="Course", description="A course", author_id=1))
+    session.add(User(id=1, username="author", password="password", role=UserRole.user))
+    session.add_all([
+        Post(id=1, title="Long", description="A post", type="note", content=long_content, author_id=1, course_id=1),
+        Post(id=2, title="Short", description="A post", type="note", content="Short", author_id=1, course_id=1),
+    ])
+    session.commit()
+    session.expire_all()
+
+    stored = dict(session.exec(text("SELECT id, content FROM post")).all())
+    assert stored[1].startswith(b"zlib:" + str(len(long_content)).encode() + b":")
+    assert len(stored[1]) < len(long_content) / 10
+    assert stored[2] == "Short"
+    assert session.get(Post, 1).content == long_content
+
+    posts, _ = get_course_post_page(session, 1, 10, summary=True)
+    assert posts[0]['content_preview'] == long_content[:CONTENT_PREVIEW_LENGTH]
+    assert posts[0]['content_length'] == len(long_content)
+    assert posts[1]['content_preview'] == "Short"
+    assert posts[1]['content_length'] == 5
+
+    assert rebuild_index(session) == 2
+    results = search_posts(session, "function calls")
+    assert [result["id"] for result in results] == [1]
+    assert "**function** **calls**" in results[0]["snippet"]
+    # The search index holds no copy of the content
+    assert session.exec(text("SELECT content FROM post_fts WHERE rowid = 1")).one()[0] is None
+
+    unindex_course(session, 1)
+    assert search_posts(session, "function calls") == []
+    # Removing posts which aren't indexed leaves the index intact
+    unindex_course(session, 1)
+    session.exec(text("INSERT INTO post_fts (post_fts) VALUES ('integrity-check')"))
+
+
+def test_sparse_posts_query(session: Session):
+    """Ensure a sparse fieldset only selects the columns it needs, and still summarizes
+    compressed content"""
+    sql = str(sparse_posts_query(1, ["title"]))
+    assert "content" not in sql and "JOIN" not in sql
+    assert "JOIN" in str(sparse_posts_query(1, ["author_username"]))
+
+    session.add(User(id=1, username="author", password="password", role=UserRole.user))
+    session.add(Course(id=1, title="Course", description="", author_id=1))
+    long_content = "Compressible content. " * 500
+    session.add(Post(id=1, title="Long", description="", type="note", author_id=1, course_id=1, content=long_content))
+    session.commit()
+
+    posts, _ = get_course_post_page(session, 1, 10, summary=True, fields=["content_preview"])
+    assert posts[0]['content_preview'] == long_content[:CONTENT_PREVIEW_LENGTH]
+    assert set(posts[0]) == {'id', 'created_at', 'content_preview', 'content_length'}
+
+
+def test_compress_existing_content(session: Session, monkeypatch):
+    """Ensure content stored before compression was enabled is compressed by the compaction,
+    and that content is decompressed again if it no longer reaches the threshold"""
+    long_content = "A long note. " * 500
+    session.exec(
+        text(
+            "INSERT INTO post (id, title, description, type, content, author_id, course_id, "
+            "approval_count, approver_usernames) "
+            "VALUES (:id, 'Post', 'A post', 'note', :content, 1, 1, 0, '[]')"
+        ),
+        params=[{'id': 1, 'content': long_content}, {'id': 2, 'content': "Short"}, {'id': 3, 'content': None}]
+    )
+    session.commit()
+    size_before = stored_content_size(session)
+
+    assert compress_existing_content(session) == 1
+    session.commit()
+    assert stored_content_size(session) < size_before / 10
+    assert session.get(Post, 1).content == long_content
+    # Already in the current form
+    assert compress_existing_content(session) == 0
+
+    monkeypatch.setattr(compression, "COMPRESSION_THRESHOLD", 100000)
+    assert compress_existing_content(session) == 1
+    session.commit()
+    assert stored_content_size(session) == size_before
+
+
+def test_database_settings_from_env(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite:////srv/capsule.sqlite3")
+    monkeypatch.setenv("DATABASE_POOL_SIZE", "20")
+    monkeypatch.setenv("DATABASE_POOL_PRE_PING", "true")
+    monkeypatch.setenv("DATABASE_SQLITE_PROFILE", "default")
+
+    settings = DatabaseSettings.from_env()
+    assert settings.pool_size == 20
+    assert settings.pool_pre_ping is True
+    assert settings.sqlite_profile == SQLiteProfile.default
+    assert settings.get_async_url() == "sqlite+aiosqlite:////srv/capsule.sqlite3"
+
+
+@pytest.mark.parametrize("profile, journal_mode, synchronous", [
+    (SQLiteProfile.default, "delete", 2),
+    (SQLiteProfile.tuned, "wal", 1),
+])
+def test_sqlite_profile_pragmas(tmp_path, profile: SQLiteProfile, journal_mode: str, synchronous: int):
+    """Ensure the pragmas of the SQLite profile are applied to every new connection"""
+    settings = DatabaseSettings(
+        url=f"sqlite:///{tmp_path / 'profile.sqlite3'}",
+        sqlite_profile=profile,
+        sqlite_busy_timeout_ms=1234,
+        pool_size=2
+    )
+    engine = make_engine(settings)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == journal_mode
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == synchronous
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 1234
+    assert engine.pool.size() == 2
+    engine.dispose()
+
+    assert make_async_engine(settings).sync_engine.pool.size() == 2
+
+
+def test_read_settings(tmp_path):
+    """Ensure reads fall back to the primary unless a replica or read-only pool is configured,
+    and that a read-only pool can't write.
+    """
+    settings = DatabaseSettings(url=f"sqlite:///{tmp_path / 'primary.sqlite3'}")
+    assert settings.get_read_settings() is None
+
+    replica = settings.model_copy(update={'read_url': "sqlite:////replica.sqlite3"}).get_read_settings()
+    assert replica.url == "sqlite:////replica.sqlite3"
+    assert replica.get_async_url() == "sqlite+aiosqlite:////replica.sqlite3"
+
+    primary = make_engine(settings)
+    SQLModel.metadata.create_all(primary)
+    read_only = settings.model_copy(update={'sqlite_read_only_pool': True}).get_read_settings()
+    assert read_only.is_read_only
+    engine = make_engine(read_only)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.execute(select(Course)).all() == []
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.exec_driver_sql("DELETE FROM course")
+    engine.dispose()
+    primary.dispose()
@@ -5,14 +5,24 @@ Unit and integration tests to ensure all of the API endpoints work correctly.
 The first part contains unit tests, while the second contains integration tests.
 """
 
+import base64
+import csv
+import datetime
+import io
+import json
 import pytest
+from pydantic import TypeAdapter
 from urllib.parse import quote
 
 from fastapi.testclient import TestClient
 from sqlmodel import Session, select
 
+import main
 from main import app
-from server.models import User, UserRole, Course, Post, Approval
+from server.models import User, UserRole, Course, Post, Approval, PostSummary, PostWithAuthor
+from server.approvals import find_inconsistent_posts, refresh_approval_summary
+from server.changes import compact_changes
+from server.queries import CONTENT_PREVIEW_LENGTH
 from server.session_security import UserSessionManager
 from utils import session_fixture  # noqa: F401
 
@@ -111,6 +121,21 @@ def test_create_course(populate_database, user_factory):
     assert response.json() == {"message": "Course created"}
 
 
+def test_create_course_duplicate_title(populate_database, user_factory):
+    """Ensure a course cannot be created with the title of an existing course"""
+    user_factory(role=UserRole.user, valid=True)
+
+    response = client.post(
+        "/courses/create",
+        json={
+            'title': 'First Course',
+            'description': 'This course already exists.'
+        }
+    )
+    assert response.status_code == 409
+    assert response.json() == {"detail": "Course already exists"}
+
+
 def test_delete_course_no_user_denied(session: Session, populate_database):
     """Ensure that when there is no user logged in, a course cannot be deleted"""
 
@@ -323,6 +348,536 @@ def test_view_post_valid_token(
     ]
 
 
+def test_course_posts_keyset_pagination(session: Session, populate_database, user_factory):
+    """Ensure the post list is served in pages that can be walked forwards and backwards
+    using the cursors in the response headers.
+    """
+    user_factory(UserRole.user)
+
+    course = session.exec(select(Course)).first()
+    start = datetime.datetime(2024, 1, 1)
+    session.add_all([
+        Post(
+            title=f"Post {i}",
+            description="Paginated post",
+            type="note",
+            content="content",
+            author_id=2,
+            course_id=course.id,
+            # posts share timestamps in pairs, so the id must break ties
+            created_at=start + datetime.timedelta(minutes=i // 2)
+        )
+        for i in range(7)
+    ])
+    session.commit()
+    # The populated post was created "now", so it sorts after the posts above
+    expected = [post.id for post in session.exec(
+        select(Post).where(Post.course_id == course.id).order_by(Post.created_at, Post.id)
+    ).all()]
+
+    escaped_title = quote(course.title, safe='')
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        params = {"limit": 3}
+        if cursor:
+            params["after"] = cursor
+        response = client.get(f"/courses/{escaped_title}/posts", params=params)
+        assert response.status_code == 200
+        seen.extend(post["id"] for post in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == expected
+    assert pages == 3
+
+    # Step back from the last page
+    response = client.get(
+        f"/courses/{escaped_title}/posts",
+        params={"limit": 3, "before": response.headers["X-Prev-Cursor"]}
+    )
+    assert [post["id"] for post in response.json()] == expected[3:6]
+
+    response = client.get(f"/courses/{escaped_title}/posts", params={"limit": 3, "order": "newest"})
+    assert [post["id"] for post in response.json()] == expected[::-1][:3]
+
+    response = client.get(f"/courses/{escaped_title}/posts", params={"after": "not-a-cursor"})
+    assert response.status_code == 400
+    # An id too large for SQLite to bind is rejected with the cursor, rather than failing the query
+    too_large = base64.urlsafe_b64encode(json.dumps(["2024-01-01T00:00:00", 10 ** 30]).encode()).decode()
+    response = client.get(f"/courses/{escaped_title}/posts", params={"after": too_large})
+    assert response.status_code == 400
+
+
+def test_course_posts_list_approvers(session: Session, populate_database, user_factory):
+    """Ensure each post is listed once, with every approver's username, no matter
+    how many approvals it has.
+    """
+    user_factory(UserRole.user)
+
+    teacher = User(username="teacher1", password="password", role=UserRole.teacher)
+    session.add(teacher)
+    session.commit()
+    post = session.exec(select(Post)).first()
+    session.add_all([
+        Approval(post_id=post.id, user_id=1),
+        Approval(post_id=post.id, user_id=teacher.id),
+    ])
+    session.flush()
+    refresh_approval_summary(session, [post.id])
+    session.commit()
+
+    course = session.exec(select(Course).where(Course.id == post.course_id)).first()
+    response = client.get(f"/courses/{quote(course.title, safe='')}/posts")
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert response.json()[0]["author_username"] == "user1"
+    assert response.json()[0]["approvers"] == ["admin1", "teacher1"]
+
+
+def test_search_posts(session: Session, populate_database, user_factory):
+    """Ensure posts created through the API can be found by full-text search, ranked
+    by relevance and optionally limited to one course.
+    """
+    user_factory(UserRole.user)
+    client.post("/courses/create", json={"title": "Biology", "description": "Life"})
+    posts = [
+        ("First Course", "Sorting algorithms", "Quicksort and mergesort", "Both sort in n log n"),
+        ("First Course", "Graphs", "Shortest paths", "Dijkstra's algorithm sorts vertices by distance"),
+        ("Biology", "Cells", "Sorting proteins", "The golgi apparatus sorts proteins"),
+        ("Biology", "Plants", "Photosynthesis", "Light becomes sugar"),
+    ]
+    for course_title, title, description, content in posts:
+        response = client.post(
+            f"/courses/{quote(course_title, safe='')}/create",
+            json={"title": title, "description": description, "content": content, "type": "Note"}
+        )
+        assert response.status_code == 200
+
+    response = client.get("/search", params={"q": "sorting"})
+    assert response.status_code == 200
+    results = response.json()
+    # "sorting" and "sorts" share a stem. A match in a title ranks above one in content.
+    assert [result["title"] for result in results] == ["Sorting algorithms", "Cells", "Graphs"]
+    assert "**Sorting**" in results[0]["snippet"]
+    assert results[2]["course_title"] == "First Course"
+
+    response = client.get("/search", params={"q": "sorting", "course": "Biology"})
+    assert [result["title"] for result in response.json()] == ["Cells"]
+
+    response = client.get("/search", params={"q": "sorting", "limit": 2, "offset": 2})
+    assert [result["title"] for result in response.json()] == ["Graphs"]
+
+    # Characters with special meaning to FTS5 are searched for literally
+    response = client.get("/search", params={"q": 'dijkstra\'s "algorithm'})
+    assert [result["title"] for result in response.json()] == ["Graphs"]
+
+    response = client.get("/search", params={"q": "sorting", "course": "Missing"})
+    assert response.status_code == 404
+
+    # Posts of a deleted course are no longer found
+    user_factory(UserRole.admin, username="searchadmin")
+    client.post(f"/courses/{quote('Biology', safe='')}/delete")
+    response = client.get("/search", params={"q": "sorting"})
+    assert [result["title"] for result in response.json()] == ["Sorting algorithms", "Graphs"]
+
+
+def test_bulk_create_posts(session: Session, populate_database, user_factory):
+    """Ensure a teacher can create many posts in one request, and that each invalid post
+    is reported without preventing the others from being created.
+    """
+    teacher = user_factory(UserRole.teacher)
+    course = session.exec(select(Course)).first()
+    escaped_title = quote(course.title, safe='')
+
+    posts = [
+        {"title": f"Imported {i}", "description": "Imported note", "type": "Note", "content": f"Note {i}"}
+        for i in range(1200)
+    ]
+    posts[5] = {"title": "Missing description", "type": "Note"}
+    posts[7] = "not a post"
+    response = client.post(f"/courses/{escaped_title}/posts/bulk", json=posts)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["created"], body["failed"]) == (1198, 2)
+    assert body["posts_per_second"] > 0
+    results = body["results"]
+    assert [result["index"] for result in results] == list(range(1200))
+    assert results[5]["created"] is False
+    assert results[5]["errors"] == ["description: Field required"]
+    assert results[7]["errors"] == ["Expected a JSON object"]
+
+    created = session.exec(select(Post).where(Post.author_id == teacher.id).order_by(Post.id)).all()
+    assert [post.id for post in created] == [result["id"] for result in results if result["created"]]
+    assert created[-1].title == "Imported 1199"
+    assert created[-1].course_id == course.id
+
+    # Imported posts are searchable
+    response = client.get("/search", params={"q": "imported", "limit": 1})
+    assert len(response.json()) == 1
+
+    # Posts can also be sent as newline-delimited JSON
+    ndjson = '{"title": "Line 1", "description": "d", "type": "Note"}\n{not json}\n\n'
+    response = client.post(
+        f"/courses/{escaped_title}/posts/bulk",
+        content=ndjson,
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert (response.json()["created"], response.json()["failed"]) == (1, 1)
+
+    # A batch which creates nothing leaves the post list's ETag as it was
+    etag = client.get(f"/courses/{escaped_title}/posts").headers["etag"]
+    for body in ([], [{"title": "No type"}]):
+        response = client.post(f"/courses/{escaped_title}/posts/bulk", json=body)
+        assert response.status_code == 200
+        assert response.json()["created"] == 0
+    assert client.get(f"/courses/{escaped_title}/posts").headers["etag"] == etag
+
+
+def test_bulk_create_posts_denied(session: Session, populate_database, user_factory):
+    """Ensure students can't bulk create posts, and that a malformed body is rejected"""
+    user_factory(UserRole.user)
+    response = client.post(f"/courses/{quote('First Course', safe='')}/posts/bulk", json=[])
+    assert response.status_code == 403
+
+    user_factory(UserRole.teacher, username="bulkteacher")
+    response = client.post(f"/courses/{quote('First Course', safe='')}/posts/bulk", json={"title": "Not a list"})
+    assert response.status_code == 400
+    response = client.post(f"/courses/{quote('Missing', safe='')}/posts/bulk", json=[])
+    assert response.status_code == 404
+
+
+def test_course_posts_match_response_model(session: Session, populate_database, user_factory):
+    """Ensure the post list, which is serialized without going through its response model,
+    is exactly what the response model would produce, and is still documented by it"""
+    user_factory(UserRole.user)
+    course = session.exec(select(Course)).first()
+    session.add(Post(title="Timed", description="Ünïcode", type="note", content=None, author_id=2,
+                     course_id=course.id, created_at=datetime.datetime(2024, 1, 1, 12, 30, 15, 250)))
+    session.commit()
+    escaped_title = quote(course.title, safe='')
+
+    for summary, model in ((False, PostWithAuthor), (True, PostSummary)):
+        response = client.get(f"/courses/{escaped_title}/posts", params={"summary": summary})
+        assert response.status_code == 200
+        adapter = TypeAdapter(list[model])
+        assert response.json() == json.loads(adapter.dump_json(adapter.validate_json(response.content)))
+
+    schema = app.openapi()["paths"]["/courses/{course_title}/posts"]["get"]["responses"]["200"]
+    assert "PostWithAuthor" in json.dumps(schema)
+
+
+def test_course_posts_summary(session: Session, populate_database, user_factory):
+    """Ensure the summary post list has a bounded preview of each post's content in place of
+    the content itself, and that the full content is still served by the single post route"""
+    user_factory(UserRole.user)
+    course = session.exec(select(Course)).first()
+    long_post = Post(title="Long", description="Long note", type="note", content="é" * 20000,
+                     author_id=2, course_id=course.id)
+    empty_post = Post(title="Empty", description="No content", type="note", content=None,
+                      author_id=2, course_id=course.id)
+    session.add_all([long_post, empty_post])
+    session.commit()
+    escaped_title = quote(course.title, safe='')
+
+    response = client.get(f"/courses/{escaped_title}/posts", params={"summary": True})
+    assert response.status_code == 200
+    posts = {post["title"]: post for post in response.json()}
+    assert "content" not in posts["Long"]
+    assert posts["Long"]["content_preview"] == "é" * CONTENT_PREVIEW_LENGTH
+    assert posts["Long"]["content_length"] == 20000
+    assert posts["Long"]["author_username"] == "user1"
+    assert posts["Empty"]["content_preview"] is None
+    assert posts["Empty"]["content_length"] == 0
+
+    full = client.get(f"/courses/{escaped_title}/posts")
+    assert len(response.content) * 10 < len(full.content)
+    assert {post["title"]: post for post in full.json()}["Long"]["content"] == "é" * 20000
+
+    response = client.get(f"/courses/{escaped_title}/posts/{long_post.id}")
+    assert response.json()["content"] == "é" * 20000
+
+
+def test_conditional_get(session: Session, populate_database, user_factory, monkeypatch):
+    """Ensure the course list, post list and single post reads are answered with 304 while
+    nothing has changed, without querying the posts, and that writes change their ETags"""
+    user_factory(UserRole.teacher)
+    course = session.exec(select(Course)).first()
+    post = session.exec(select(Post)).first()
+    escaped_title = quote(course.title, safe='')
+    urls = ["/courses", f"/courses/{escaped_title}/posts", f"/courses/{escaped_title}/posts/{post.id}"]
+
+    etags = {}
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200
+        etags[url] = response.headers["etag"]
+    # Responses with different parameters have different ETags
+    assert client.get(urls[1], params={"summary": True}).headers["etag"] != etags[urls[1]]
+
+    def no_query(*args, **kwargs):
+        raise AssertionError("The post list was queried")
+    with monkeypatch.context() as patch:
+        patch.setattr(main, "get_course_post_page", no_query)
+        for url in urls:
+            response = client.get(url, headers={"If-None-Match": etags[url]})
+            assert response.status_code == 304
+            assert response.headers["etag"] == etags[url]
+            assert response.content == b""
+    assert client.get(urls[0], headers={"If-None-Match": '"other", ' + etags[urls[0]]}).status_code == 304
+
+    response = client.post(f"/courses/{escaped_title}/create",
+                           json={"title": "New", "description": "A new post", "type": "note"})
+    assert response.status_code == 200
+    for url in urls:
+        response = client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etags[url]
+        etags[url] = response.headers["etag"]
+
+    response = client.post(f"/courses/{escaped_title}/posts/{post.id}/approve")
+    assert response.status_code == 200
+    assert client.get(urls[1], headers={"If-None-Match": etags[urls[1]]}).status_code == 200
+    # Approving again writes nothing, so the post list is unchanged
+    etags[urls[1]] = client.get(urls[1]).headers["etag"]
+    client.post(f"/courses/{escaped_title}/posts/{post.id}/approve")
+    assert client.get(urls[1], headers={"If-None-Match": etags[urls[1]]}).status_code == 304
+
+
+def test_sparse_fieldsets(session: Session, populate_database, user_factory):
+    """Ensure the course and post lists can be narrowed to the fields a client needs"""
+    user_factory(UserRole.user)
+    escaped_title = quote("First Course", safe='')
+    session.add_all([
+        Post(title=f"Post {i}", description="", author_id=1, course_id=1, type="note", content="x" * 300)
+        for i in range(3)
+    ])
+    session.commit()
+
+    response = client.get("/courses", params={"fields": "title,id"})
+    assert response.status_code == 200
+    assert response.json() == [{"id": 1, "title": "First Course"}]
+    # Titles out of id order, since a title index could otherwise sort them
+    session.add_all([Course(id=2, title="C", description="", author_id=1),
+                     Course(id=3, title="B", description="", author_id=1)])
+    session.commit()
+    full = client.get("/courses").json()
+    assert [course["id"] for course in full] == [1, 2, 3]
+    assert client.get("/courses", params={"fields": "id,title"}).json() == [
+        {"id": course["id"], "title": course["title"]} for course in full]
+
+    full = client.get(f"/courses/{escaped_title}/posts", params={"limit": 2})
+    response = client.get(f"/courses/{escaped_title}/posts", params={"limit": 2, "fields": "title,author_username"})
+    assert response.status_code == 200
+    assert response.json() == [{"title": post["title"], "author_username": post["author_username"]}
+                               for post in full.json()]
+    # The cursors are built from fields which weren't requested
+    assert response.headers["x-next-cursor"] == full.headers["x-next-cursor"]
+    assert response.headers["etag"] != full.headers["etag"]
+
+    response = client.get(f"/courses/{escaped_title}/posts",
+                          params={"summary": True, "fields": "id,content_length"})
+    assert response.json()[1:] == [{"id": 2, "content_length": 300}, {"id": 3, "content_length": 300},
+                                   {"id": 4, "content_length": 300}]
+
+    for url, fields in [("/courses", "title,author"), (f"/courses/{escaped_title}/posts", "content_preview"),
+                        (f"/courses/{escaped_title}/posts", ",")]:
+        response = client.get(url, params={"fields": fields})
+        assert response.status_code == 400
+
+
+def test_course_page(session: Session, populate_database, user_factory):
+    """Ensure the course page returns the course, the user and the first page of posts at
+    once, matching the responses of the separate endpoints"""
+    user = user_factory(UserRole.teacher)
+    escaped_title = quote("First Course", safe='')
+    session.add_all([
+        Post(title=f"Post {i}", description="", author_id=1, course_id=1, type="note", content="x" * 300)
+        for i in range(3)
+    ])
+    session.commit()
+
+    response = client.get(f"/courses/{escaped_title}/page", params={"limit": 2, "summary": True})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["course"]["title"] == "First Course"
+    assert page["course"]["description"] == "This is the first course"
+    assert page["user"] == {"logged_in": True, "username": user.username, "email": None, "role": UserRole.teacher.value}
+    posts = client.get(f"/courses/{escaped_title}/posts", params={"limit": 2, "summary": True})
+    assert page["posts"] == posts.json()
+    assert response.headers["x-next-cursor"] == posts.headers["x-next-cursor"]
+    assert client.get(f"/courses/{escaped_title}/page", params={"limit": 2, "summary": True},
+                      headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+    # A token carrying the user's display fields is answered without looking the user up
+    token = UserSessionManager.sign_jwt(user.id, user.role, username="from token", email="token@example.com")
+    client.cookies["access_token"] = f"Bearer {token}"
+    page = client.get(f"/courses/{escaped_title}/page").json()
+    assert page["user"]["username"] == "from token"
+    assert len(page["posts"]) == 4
+
+    assert client.get("/courses/Nonexistent/page").status_code == 404
+
+
+def test_change_feed(session: Session, populate_database, user_factory):
+    """Ensure clients can fetch the changes made since they last synced, a page at a time,
+    and are told to download everything again once those changes have been trimmed"""
+    user_factory(UserRole.admin)
+    # Without a cursor, a client downloads everything and continues from the latest change
+    response = client.get("/changes")
+    assert response.status_code == 200
+    assert response.json() == {"changes": [], "next": 0, "more": False, "reset": True}
+
+    assert client.post("/courses/create", json={"title": "New Course", "description": "A course"}).status_code == 200
+    escaped_title = quote("New Course", safe='')
+    client.post(f"/courses/{escaped_title}/create", json={"title": "New", "description": "A post", "type": "note"})
+    post_id = session.exec(select(Post.id).where(Post.title == "New")).one()
+    client.post(f"/courses/{escaped_title}/posts/{post_id}/approve")
+    client.post(f"/courses/{escaped_title}/posts/{post_id}/unapprove")
+    client.post(f"/courses/{escaped_title}/delete")
+
+    response = client.get("/changes", params={"since": 0, "limit": 3})
+    assert response.status_code == 200
+    feed = response.json()
+    assert not feed["reset"] and feed["more"]
+    assert [(change["type"], change["course_title"], change["post_id"]) for change in feed["changes"]] == [
+        ("course-created", "New Course", None),
+        ("post-created", "New Course", post_id),
+        ("post-approved", "New Course", post_id),
+    ]
+    feed = client.get("/changes", params={"since": feed["next"]}).json()
+    assert [change["type"] for change in feed["changes"]] == ["post-unapproved", "course-deleted"]
+    assert not feed["more"]
+    latest = feed["next"]
+    assert client.get("/changes", params={"since": latest}).json()["changes"] == []
+
+    # Once trimmed, only the latest change is kept, and older cursors are told to reset
+    assert compact_changes(session, datetime.timedelta(0)) == 4
+    session.commit()
+    assert client.get("/changes", params={"since": 0}).json() == {
+        "changes": [], "next": latest, "more": False, "reset": True}
+    assert client.get("/changes", params={"since": latest - 1}).json()["changes"][0]["seq"] == latest
+    assert client.get("/changes", params={"since": latest}).json()["reset"] is False
+    # A cursor from ahead of the log, e.g. from before a restore, can't be caught up either
+    assert client.get("/changes", params={"since": latest + 1000}).json() == {
+        "changes": [], "next": latest, "more": False, "reset": True}
+
+
+def test_writes_skip_events_without_subscribers(session: Session, populate_database, user_factory, monkeypatch):
+    """Ensure the payloads of live events aren't queried while no one is subscribed"""
+    user_factory(UserRole.teacher)
+    escaped_title = quote("First Course", safe='')
+
+    def no_query(*args, **kwargs):
+        raise AssertionError("An event payload was queried")
+    monkeypatch.setattr(main, "get_post_summary", no_query)
+    monkeypatch.setattr(main, "get_approval_summaries", no_query)
+
+    response = client.post(f"/courses/{escaped_title}/create", json={"title": "New", "description": "", "type": "note"})
+    assert response.status_code == 200
+    assert client.post(f"/courses/{escaped_title}/posts/1/approve").status_code == 200
+    assert client.post(f"/courses/{escaped_title}/posts/1/unapprove").status_code == 200
+    response = client.post(f"/courses/{escaped_title}/posts/approvals", json={"approve": [1]})
+    assert response.json()["approved"] == [1]
+
+
+def test_export_course_posts(session: Session, populate_database, user_factory):
+    """Ensure a course's posts can be downloaded as NDJSON and as CSV"""
+    user_factory(UserRole.teacher)
+    course = session.exec(select(Course)).first()
+    session.add_all([
+        Post(title=f"Exported {i}", description="Has, a comma", type="note", content=f"Line one\nLine {i}",
+             author_id=2, course_id=course.id, created_at=datetime.datetime(2024, 1, 1, 0, i))
+        for i in range(3)
+    ])
+    session.commit()
+    escaped_title = quote(course.title, safe='')
+
+    response = client.get(f"/courses/{escaped_title}/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"] == "attachment; filename*=UTF-8''First%20Course.ndjson"
+    posts = [json.loads(line) for line in response.text.splitlines()]
+    # The posts are oldest first, and the populated post was created now
+    assert [post["title"] for post in posts] == ["Exported 0", "Exported 1", "Exported 2", "Initial Post"]
+    assert posts[0]["author_username"] == "user1"
+    assert posts[0]["content"] == "Line one\nLine 0"
+    # Timestamps are in the same form as the post list's
+    listed = client.get(f"/courses/{escaped_title}/posts").json()
+    assert [post["created_at"] for post in posts] == [post["created_at"] for post in listed]
+    assert posts[0]["created_at"] == "2024-01-01T00:00:00"
+
+    response = client.get(f"/courses/{escaped_title}/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["title"] for row in rows] == ["Exported 0", "Exported 1", "Exported 2", "Initial Post"]
+    assert rows[1]["description"] == "Has, a comma"
+    assert rows[1]["content"] == "Line one\nLine 1"
+    assert rows[1]["approvers"] == "[]"
+    assert [row["created_at"] for row in rows] == [post["created_at"] for post in listed]
+
+    response = client.get(f"/courses/{quote('Missing', safe='')}/export")
+    assert response.status_code == 404
+
+
+def test_login_rehashes_plaintext_password(session: Session, populate_database):
+    """Ensure a user whose password was stored in plaintext can log in, after which only a
+    hash of their password is stored"""
+    response = client.post("/login", json={"username": "user1", "password": "wrong"})
+    assert response.json()["logged_in"] is False
+    response = client.post("/login", json={"username": "nobody", "password": "password"})
+    assert response.json()["logged_in"] is False
+
+    response = client.post("/login", json={"username": "user1", "password": "password"})
+    assert response.json()["logged_in"] is True
+    user = session.exec(select(User).where(User.username == "user1")).first()
+    session.refresh(user)
+    assert user.password.startswith("$pbkdf2-sha256$")
+
+    response = client.post("/login", json={"username": "user1", "password": "password"})
+    assert response.json()["logged_in"] is True
+
+
+def test_verify_token_from_claims(session: Session, populate_database, monkeypatch):
+    """Ensure the login status is answered from the token's claims without looking up the
+    user, and that tokens without current claims still get it from the database"""
+    def no_lookup(*args, **kwargs):
+        raise AssertionError("The user was looked up")
+
+    token = UserSessionManager.sign_jwt(2, UserRole.user, "user1", "user1@example.com")
+    client.cookies.update({"access_token": f"Bearer {token}"})
+    with monkeypatch.context() as patch:
+        patch.setattr(main, "get_user_data", no_lookup)
+        response = client.get("/verify-token")
+    assert response.status_code == 200
+    assert response.json() == {"logged_in": True, "username": "user1", "email": "user1@example.com", "role": 0}
+
+    # A token issued before the claims were added
+    token = UserSessionManager.sign_jwt(2, UserRole.user)
+    client.cookies.update({"access_token": f"Bearer {token}"})
+    response = client.get("/verify-token")
+    assert response.json() == {"logged_in": True, "username": "user1", "email": "user1@example.com", "role": 0}
+
+    del client.cookies["access_token"]
+    assert client.get("/verify-token").json()["logged_in"] is False
+
+
+def test_logout_revokes_token(session: Session, populate_database, user_factory):
+    """Ensure a session token stops being accepted once its user logs out"""
+    user_factory(UserRole.user)
+    assert client.get("/courses").status_code == 200
+    token = client.cookies["access_token"]
+
+    response = client.post("/logout")
+    assert response.status_code == 200
+    client.cookies.update({"access_token": token})
+    assert client.get("/courses").status_code == 401
+
+
 def test_create_account(session: Session):
     """Ensure that after a user registers a new account, their new account
     exists in the database.
@@ -341,6 +896,10 @@ def test_create_account(session: Session):
     user = session.exec(select(User).where(User.username == "newuser")).first()
     assert user is not None
     assert user.email == "newuser@example.com"
+    # Only a hash of the password is stored
+    assert user.password != "newpassword"
+    response = client.post("/login", json={"username": "newuser", "password": "newpassword"})
+    assert response.json()["logged_in"] is True
 
 
 def test_admin_approves_post(session: Session, populate_database, user_factory):
@@ -361,6 +920,73 @@ def test_admin_approves_post(session: Session, populate_database, user_factory):
     approval = session.exec(select(Approval).where(Approval.post_id == 1, Approval.user_id == admin.id)).first()
     assert approval is not None
 
+    # The post's approval summary is updated along with the approval
+    post = session.exec(select(Post).where(Post.id == 1)).first()
+    session.refresh(post)
+    assert post.approval_count == 1
+    assert post.approver_usernames == [admin.username]
+
+
+def test_approve_post_idempotent(session: Session, populate_database, user_factory):
+    """Ensure approving a post twice is not an error, and that approvals can be removed"""
+    teacher = user_factory(role=UserRole.teacher, valid=True)
+    escaped_title = quote("First Course", safe='')
+
+    for _ in range(2):
+        response = client.post(f"/courses/{escaped_title}/posts/1/approve")
+        assert response.status_code == 200
+        assert response.json() == {"message": "Post approved"}
+    approvals = session.exec(select(Approval).where(Approval.post_id == 1)).all()
+    assert [approval.user_id for approval in approvals] == [teacher.id]
+
+    response = client.post(f"/courses/{escaped_title}/posts/1/unapprove")
+    assert response.status_code == 200
+    assert session.exec(select(Approval).where(Approval.post_id == 1)).first() is None
+    post = session.get(Post, 1)
+    session.refresh(post)
+    assert post.approval_count == 0
+
+    response = client.post(f"/courses/{escaped_title}/posts/999/approve")
+    assert response.status_code == 404
+
+
+def test_batch_approvals(session: Session, populate_database, user_factory):
+    """Ensure a teacher can approve and unapprove many posts of a course in one request"""
+    teacher = user_factory(role=UserRole.teacher, valid=True)
+    other_course = Course(id=2, title="Second Course", description="Another course", author_id=1)
+    session.add(other_course)
+    session.add_all([
+        Post(id=i, title=f"Post {i}", description="A post", type="note", author_id=2, course_id=1)
+        for i in (2, 3, 4)
+    ])
+    session.add(Post(id=5, title="Elsewhere", description="A post", type="note", author_id=2, course_id=2))
+    session.commit()
+    escaped_title = quote("First Course", safe='')
+
+    response = client.post(f"/courses/{escaped_title}/posts/1/approve")
+    response = client.post(
+        f"/courses/{escaped_title}/posts/approvals",
+        json={"approve": [1, 2, 3, 5, 999]}
+    )
+    assert response.status_code == 200
+    # Post 1 was already approved, and posts 5 and 999 aren't in the course
+    assert response.json() == {"approved": [2, 3], "unapproved": [], "not_found": [5, 999]}
+
+    response = client.post(
+        f"/courses/{escaped_title}/posts/approvals",
+        json={"approve": [4], "unapprove": [1, 2, 4]}
+    )
+    # Approvals are applied before removals
+    assert response.json() == {"approved": [4], "unapproved": [1, 2, 4], "not_found": []}
+
+    approved = session.exec(select(Approval.post_id).where(Approval.user_id == teacher.id)).all()
+    assert approved == [3]
+    response = client.get(f"/courses/{escaped_title}/posts")
+    assert {post["id"]: post["approvers"] for post in response.json()} == {
+        1: [], 2: [], 3: [teacher.username], 4: []
+    }
+    assert find_inconsistent_posts(session) == []
+
 
 """
 ########################################################
@@ -0,0 +1,83 @@
+"""
+tests/test_events.py
+
+Unit tests for the broker publishing live updates to a course's subscribers.
+"""
+
+import asyncio
+
+import pytest
+
+from server.events import EventBroker, EventType
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+def drain(subscription) -> list:
+    events = []
+    while not subscription.queue.empty():
+        events.append(subscription.queue.get_nowait())
+    return events
+
+
+@pytest.mark.anyio
+async def test_events_reach_only_the_course_subscribers():
+    broker = EventBroker()
+    with broker.subscribe(1) as first, broker.subscribe(1) as second, broker.subscribe(2) as other:
+        broker.publish(1, EventType.post_created, {'id': 10})
+        assert [event.data for event in drain(first)] == [{'id': 10}]
+        assert [event.data for event in drain(second)] == [{'id': 10}]
+        assert drain(other) == []
+        assert broker.stats() == {'subscribers': 3, 'published': 1, 'dropped': 0}
+    assert broker.stats()['subscribers'] == 0
+
+
+def test_has_subscribers():
+    broker = EventBroker()
+    assert not broker.has_subscribers() and not broker.has_subscribers(1)
+    with broker.subscribe(1):
+        assert broker.has_subscribers() and broker.has_subscribers(1)
+        assert not broker.has_subscribers(2)
+    assert not broker.has_subscribers() and not broker.has_subscribers(1)
+
+
+@pytest.mark.anyio
+async def test_slow_subscriber_is_told_to_resync():
+    """Ensure a subscriber which falls behind has its backlog replaced by one `resync` event,
+    without holding up the publisher or other subscribers"""
+    broker = EventBroker(max_queued=3)
+    with broker.subscribe(1) as slow, broker.subscribe(1) as fast:
+        for post_id in range(3):
+            broker.publish(1, EventType.post_created, {'id': post_id})
+        assert len(drain(fast)) == 3
+        broker.publish(1, EventType.post_created, {'id': 3})
+
+        assert [event.type for event in drain(slow)] == [EventType.resync]
+        assert [event.data for event in drain(fast)] == [{'id': 3}]
+        assert broker.stats()['dropped'] == 4
+
+        # Once caught up, the subscriber receives events again
+        broker.publish(1, EventType.post_created, {'id': 4})
+        assert [event.data for event in drain(slow)] == [{'id': 4}]
+
+
+@pytest.mark.anyio
+async def test_course_deletion_ends_streams():
+    """Ensure deleting a course replaces any backlog with the deletion, then ends the stream"""
+    broker = EventBroker(max_queued=2)
+    stream = broker.stream(1)
+    # Start the stream, so it subscribes and waits for the first event
+    first_chunk = asyncio.ensure_future(anext(stream))
+    await asyncio.sleep(0)
+    assert broker.stats()['subscribers'] == 1
+
+    for post_id in range(5):
+        broker.publish(1, EventType.post_created, {'id': post_id})
+    broker.close_course(1)
+
+    chunks = [await first_chunk] + [chunk async for chunk in stream]
+    assert [chunk.split(b"\n")[1] for chunk in chunks] == [b"event: course-deleted"]
+    assert broker.stats()['subscribers'] == 0
@@ -0,0 +1,91 @@
+"""
+tests/test_metrics.py
+
+Tests for the request metrics and their exposition at `/metrics`.
+"""
+
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from main import app
+from server.metrics import Histogram, RequestMetrics, RequestStats, render_request_metrics, request_metrics
+from server.models import Course, User, UserRole
+from server.session_security import UserSessionManager
+from utils import session_fixture  # noqa: F401
+
+
+client = TestClient(app=app)
+
+
+def metric_value(text: str, name: str, **labels) -> float:
+    """The value of a sample in the exposition format, matching the given labels"""
+    for line in text.splitlines():
+        match = re.fullmatch(r'([a-z_]+)(?:\{(.*)\})? (\S+)', line)
+        if match and match[1] == name:
+            sample_labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match[2] or ""))
+            if all(sample_labels.get(key) == str(value) for key, value in labels.items()):
+                return float(match[3])
+    raise KeyError(name, labels)
+
+
+def test_histogram_buckets():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    # A value on a bucket's bound is counted in that bucket
+    assert histogram.cumulative_counts() == [("0.1", 2), ("1.0", 3), ("+Inf", 4)]
+    assert histogram.sum == pytest.approx(5.65)
+
+
+def test_render_request_metrics():
+    metrics = RequestMetrics()
+    stats = RequestStats()
+    stats.queries = 3
+    metrics.record("GET", '/courses/{course_title}/posts', 200, 0.02, stats)
+    metrics.record("GET", '/courses/{course_title}/posts', 404, 0.002, RequestStats())
+    text = "\n".join(render_request_metrics(metrics))
+
+    route = '/courses/{course_title}/posts'
+    assert metric_value(text, "http_requests_total", route=route, status=200) == 1
+    assert metric_value(text, "http_requests_total", route=route, status=404) == 1
+    assert metric_value(text, "http_request_duration_seconds_bucket", route=route, le="0.005") == 1
+    assert metric_value(text, "http_request_duration_seconds_bucket", route=route, le="+Inf") == 2
+    assert metric_value(text, "http_request_duration_seconds_count", route=route) == 2
+    assert metric_value(text, "db_queries_total", route=route) == 3
+
+
+def test_metrics_endpoint(session: Session):
+    """Ensure requests are recorded under their route template, along with the queries
+    made while serving them"""
+    session.add(User(id=1, username="admin", password="password", role=UserRole.admin))
+    session.add(Course(id=1, title="First Course", description="", author_id=1))
+    session.commit()
+    request_metrics.clear()
+    client.cookies["access_token"] = f"Bearer {UserSessionManager.sign_jwt(1, UserRole.admin)}"
+    try:
+        assert client.get("/courses/First Course/posts").status_code == 200
+        assert client.get("/courses/Other Course/posts").status_code == 404
+        assert client.get("/no-such-route").status_code == 404
+    finally:
+        del client.cookies["access_token"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    route = '/courses/{course_title}/posts'
+    assert metric_value(text, "http_requests_total", method="GET", route=route, status=200) == 1
+    assert metric_value(text, "http_requests_total", method="GET", route=route, status=404) == 1
+    assert metric_value(text, "http_requests_total", route="unmatched", status=404) == 1
+    # Both course lookups, the versions and the post list query, which runs in a task of
+    # its own to be coalesced, are all counted
+    assert metric_value(text, "db_queries_total", route=route) == 4
+    assert metric_value(text, "db_query_duration_seconds_total", route=route) > 0
+    assert metric_value(text, "token_cache_misses_total") >= 1
+    assert metric_value(text, "course_cache_size") >= 1
+    assert metric_value(text, "post_list_flights_executed_total") >= 1
+    assert metric_value(text, "course_events_subscribers") == 0
+    assert metric_value(text, "password_hash_workers") >= 1
@@ -1,37 +1,69 @@
-import pytest
-from sqlmodel import SQLModel, Session, create_engine
-from sqlmodel.pool import StaticPool
+import contextlib
+from pathlib import Path
 
-from main import app, get_session
+import pytest
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from main import app, get_async_session, get_async_read_session
+from server.cache import course_cache
+from server.engine import make_async_engine, make_engine
+from server.session_security import token_cache
+from server.settings import DatabaseSettings
 
-# Constants
-TEST_DATABASE_URL = "sqlite:///:memory:"
 
+@contextlib.contextmanager
+def temporary_database(directory: Path):
+    """Create an empty SQLite database for a single test, and point the API at it.
 
-@pytest.fixture(name='session')
-def session_fixture():
-    # Set up an in-memory SQLite database for testing
-    engine = create_engine(
-        TEST_DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool
+    The API reads and writes through its own async connections, so the database is a
+    file which both the test and the API can connect to. It is discarded with the test's
+    temporary directory.
+    """
+    settings = DatabaseSettings(url=f"sqlite:///{directory / 'test.sqlite3'}")
+    engine = make_engine(settings)
+    # TestClient runs each request in a fresh event loop, and aiosqlite connections are
+    # tied to the loop which opened them, so connections can't be pooled between requests
+    async_engine = make_async_engine(settings, poolclass=NullPool)
+    # Read-only requests get read-only connections, so any writes they make fail the test
+    async_read_engine = make_async_engine(
+        settings.model_copy(update={'sqlite_read_only_pool': True}).get_read_settings(),
+        poolclass=NullPool
     )
     SQLModel.metadata.create_all(engine)
 
-    # Begin a transaction
-    with engine.connect() as conn:
-        with conn.begin() as transaction:
-            with Session(bind=conn, join_transaction_mode="create_savepoint") as session:
-                def get_session_override():  
-                    return session  
+    async def get_async_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    async def get_async_read_session_override():
+        async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
+            yield session
 
-                # API endpoints use the get_session dependency to access the
-                # database. We override the dependency with the session fixture.
-                app.dependency_overrides[get_session] = get_session_override
+    # API endpoints use the get_async_session and get_async_read_session dependencies
+    # to access the database. We override them to use the test database.
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    app.dependency_overrides[get_async_read_session] = get_async_read_session_override
 
-                yield session
+    yield engine, async_engine
+
+    app.dependency_overrides.clear()
+    # Cached courses and verified tokens refer to rows of the database being discarded
+    course_cache.clear()
+    token_cache.clear()
+    engine.dispose()
+
+
+@pytest.fixture(name='session')
+def session_fixture(tmp_path: Path):
+    with temporary_database(tmp_path) as (engine, _):
+        with Session(engine) as session:
+            yield session
 
-                app.dependency_overrides.clear()
 
-            transaction.rollback()  # Rollback the transaction to clear the data
+@pytest.fixture(name='async_session')
+async def async_session_fixture(tmp_path: Path):
+    with temporary_database(tmp_path) as (_, async_engine):
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session